@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+USER_KEY_PREFIX = "auth:user"
+
+_MISSING = object()
+
+
+def get_user_cache_key(user_id):
+    return f"{USER_KEY_PREFIX}:{user_id}"
+
+
+def get_cached_user(user_id):
+    """
+    Return the user with the given id, or None, from a cache entry living
+    AUTH_USER_CACHE_TIMEOUT seconds. Entries are dropped when the user is saved or deleted.
+    """
+    key = get_user_cache_key(user_id)
+    user = cache.get(key, _MISSING)
+    if user is _MISSING:
+        user = get_user_model().objects.filter(pk=user_id).first()
+        cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(get_user_cache_key(user_id))
+
+
+class CachedTokenUser:
+    """
+    The user of a verified access token, see SIMPLE_JWT["TOKEN_USER_CLASS"].
+
+    `id` and `pk` come from the signed claims, so views that only need the id of the user
+    authenticate without any lookup. Any other attribute loads the full user with
+    get_cached_user() on first access, which rejects deleted and deactivated users.
+    Model fields and querysets must be given `request.user.id`, this isn't a model instance.
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, token):
+        self.token = token
+        self.id = self.pk = token[api_settings.USER_ID_CLAIM]
+
+    @cached_property
+    def user(self):
+        user = get_cached_user(self.id)
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+    def __getattr__(self, name):
+        # Called only for attributes not set above, never for the claims
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __str__(self):
+        return f"TokenUser {self.id}"
+
+    def __eq__(self, other):
+        return getattr(other, "pk", None) == self.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+
+class CachedJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    JWT authentication without a database query per request, `request.user` is a
+    CachedTokenUser.
+
+    Safe requests trust the signed claims. Unsafe ones also check the cached user, so a
+    deactivated user can't change anything once the cache entry is dropped, while reads
+    keep working until the access token expires. Views that write on safe requests too,
+    e.g. create the cart of the user on GET, set `check_token_user = True`.
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None and self.must_check_user(request):
+            # Raises AuthenticationFailed for deleted and deactivated users
+            result[0].user
+        return result
+
+    @staticmethod
+    def must_check_user(request):
+        view = request.parser_context.get("view")
+        return request.method not in SAFE_METHODS or getattr(view, "check_token_user", False)
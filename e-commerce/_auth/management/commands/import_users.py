@@ -0,0 +1,159 @@
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+
+def _init_worker():
+    # Workers started with spawn or forkserver don't inherit the configured apps
+    django.setup()
+
+
+def hash_passwords(passwords):
+    # Empty passwords become unusable ones, like create_user(password=None)
+    return [make_password(password or None) for password in passwords]
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users from a CSV file with a header row or from NDJSON, one object per line. "
+        "Columns are username, email, first_name, last_name and either password or "
+        "password_hash, an already hashed password e.g. from another Django deployment. "
+        "Passwords are hashed in a process pool and users are inserted in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, - for stdin")
+        parser.add_argument(
+            "--format", choices=sorted(set(FORMATS.values())), help="Default: from the extension"
+        )
+        parser.add_argument("--batch-size", type=int, default=500, help="Users per INSERT")
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument(
+            "--ignore-conflicts",
+            action="store_true",
+            help="Skip users whose username already exists instead of stopping",
+        )
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or FORMATS.get(os.path.splitext(options["path"])[1])
+        if file_format is None:
+            raise CommandError("Can't tell the format from the extension, pass --format")
+
+        self.imported = self.skipped = 0
+        started = time.perf_counter()
+        source = (
+            nullcontext(sys.stdin)
+            if options["path"] == "-"
+            else open(options["path"], newline="", encoding="utf-8")
+        )
+        with source as file:
+            users = self.read_users(self.read_rows(file, file_format))
+            batches = iter(lambda: list(islice(users, options["batch_size"])), [])
+            with ProcessPoolExecutor(options["workers"], initializer=_init_worker) as executor:
+                # Batches are hashed ahead while earlier ones are inserted
+                pending = deque()
+                try:
+                    for batch in batches:
+                        passwords = [password for user, password in batch if not user.password]
+                        pending.append((batch, executor.submit(hash_passwords, passwords)))
+                        if len(pending) > options["workers"]:
+                            self.insert(*pending.popleft(), options)
+                    while pending:
+                        self.insert(*pending.popleft(), options)
+                except BaseException:
+                    # Don't hash the batches that won't be inserted
+                    executor.shutdown(cancel_futures=True)
+                    raise
+
+        elapsed = time.perf_counter() - started
+        # bulk_create() doesn't tell which rows were ignored
+        existing = ", existing usernames included" if options["ignore_conflicts"] else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {self.imported} users{existing} in {elapsed:.1f}s "
+                f"({self.imported / elapsed:,.0f} users/s), skipped {self.skipped} invalid rows"
+            )
+        )
+
+    @staticmethod
+    def read_rows(file, file_format):
+        if file_format == "csv":
+            # Line numbers count the header
+            yield from enumerate(csv.DictReader(file), start=2)
+            return
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as exc:
+                    yield line_number, exc
+
+    def read_users(self, rows):
+        """
+        Yields (user, password) pairs. Users with a password_hash already have their password
+        set and the raw password of the others is hashed by the workers.
+        """
+        User = get_user_model()
+        for line_number, row in rows:
+            error = self.validate(row)
+            if error:
+                self.skipped += 1
+                self.stderr.write(f"Line {line_number}: {error}")
+                continue
+            user = User(
+                username=User.normalize_username(row["username"]),
+                email=User.objects.normalize_email(row.get("email") or ""),
+                first_name=row.get("first_name") or "",
+                last_name=row.get("last_name") or "",
+                password=row.get("password_hash") or "",
+            )
+            yield user, row.get("password") or ""
+
+    @staticmethod
+    def validate(row):
+        if isinstance(row, Exception):
+            return f"invalid JSON: {row}"
+        if not isinstance(row, dict):
+            return "not an object"
+        if not row.get("username"):
+            return "no username"
+        if row.get("password_hash"):
+            try:
+                identify_hasher(row["password_hash"])
+            except ValueError:
+                return "password_hash of an unknown hasher"
+        return None
+
+    def insert(self, batch, hashed, options):
+        hashes = iter(hashed.result())
+        users = []
+        for user, _password in batch:
+            if not user.password:
+                user.password = next(hashes)
+            users.append(user)
+        try:
+            created = get_user_model().objects.bulk_create(
+                users, ignore_conflicts=options["ignore_conflicts"]
+            )
+        except IntegrityError as exc:
+            raise CommandError(
+                f"{exc}\nImported {self.imported} users before the error, "
+                "rerun with --ignore-conflicts to skip existing usernames"
+            )
+        self.imported += len(created)
+        if options["verbosity"] > 1:
+            self.stdout.write(f"Imported {self.imported} users")
@@ -0,0 +1,9 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    """
+    The `jwtAuth` bearer scheme of the schema, extensions only match their exact class.
+    """
+
+    target_class = "_auth.authentication.CachedJWTAuthentication"
@@ -0,0 +1,18 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from .authentication import invalidate_cached_user
+
+
+def invalidate_user_cache(sender, instance, **kwargs):
+    # After commit, otherwise a concurrent request can cache the old user again
+    transaction.on_commit(partial(invalidate_cached_user, instance.pk))
+
+
+post_save.connect(invalidate_user_cache, sender=get_user_model(), dispatch_uid="auth:user:save")
+post_delete.connect(
+    invalidate_user_cache, sender=get_user_model(), dispatch_uid="auth:user:delete"
+)
@@ -1 +1,141 @@
-# Create your tests here.
+import json
+from io import StringIO
+
+import pytest
+from core.models.products import Category, Product
+from django.contrib.auth import base_user, get_user_model
+from django.contrib.auth import models as auth_models
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+User = get_user_model()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    caches["local"].clear()
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username="testuser", password="password")
+
+
+@pytest.fixture
+def product():
+    category = Category.objects.create(name="Electronics")
+    return Product.objects.create(
+        name="Phone", description="Smartphone", price=100, stock_quantity=10, category=category
+    )
+
+
+def _user_queries(queries):
+    return [query["sql"] for query in queries if 'FROM "auth_user"' in query["sql"]]
+
+
+@pytest.mark.django_db
+def test_jwt_requests_dont_query_users(user, product, django_capture_on_commit_callbacks):
+    refresh = RefreshToken.for_user(user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {refresh.access_token}")
+
+    with CaptureQueriesContext(connection) as queries:
+        assert client.get("/api/orders/").status_code == 200
+    assert not _user_queries(queries)
+
+    # The full user comes from the cache
+    assert client.get("/api/auth/user/").data["username"] == "testuser"
+    with CaptureQueriesContext(connection) as queries:
+        assert client.get("/api/auth/user/").data["username"] == "testuser"
+    assert not _user_queries(queries)
+
+    # Deactivated users can still read until the access token expires, but not write
+    with django_capture_on_commit_callbacks(execute=True):
+        user.is_active = False
+        user.save()
+    assert client.get("/api/orders/").status_code == 200
+    response = client.post("/api/wishlist/products/", {"product_id": product.id})
+    assert response.status_code == 401
+    response = APIClient().post("/api/auth/token/refresh/", {"refresh": str(refresh)})
+    assert response.status_code == 401
+
+    # Reading the cart or wishlist creates it, so the user must still exist
+    deleted = User.objects.create_user(username="deleted")
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(deleted).access_token}")
+    assert client.get("/api/wishlist/").status_code == 200
+    with django_capture_on_commit_callbacks(execute=True):
+        deleted.delete()
+    assert client.get("/api/shopping-cart/").status_code == 401
+    assert client.get("/api/wishlist/").status_code == 401
+
+
+@pytest.mark.django_db
+def test_registration_hashes_password_once(monkeypatch):
+    hashed = []
+
+    def counting_make_password(password, *args, **kwargs):
+        hashed.append(password)
+        return make_password(password, *args, **kwargs)
+
+    # create_user() and set_password() import it from different modules
+    monkeypatch.setattr(auth_models, "make_password", counting_make_password)
+    monkeypatch.setattr(base_user, "make_password", counting_make_password)
+    with CaptureQueriesContext(connection) as queries:
+        response = APIClient().post(
+            "/api/auth/register/", {"username": "newuser", "password": "s3cret-pass"}
+        )
+    assert response.status_code == 201
+    assert hashed == ["s3cret-pass"]
+    # Besides the uniqueness check of the username
+    writes = [query["sql"].split()[0] for query in queries if not query["sql"].startswith("SELECT")]
+    assert writes == ["INSERT"]
+    assert User.objects.get(username="newuser").check_password("s3cret-pass")
+
+
+@pytest.mark.django_db
+def test_import_users(user, tmp_path):
+    path = tmp_path / "users.ndjson"
+    path.write_text(
+        "\n".join(
+            [
+                '{"username": "alice", "email": "alice@EXAMPLE.com", "password": "alice-pass"}',
+                f'{{"username": "bob", "password_hash": "{make_password("bob-pass")}"}}',
+                '{"username": "carol"}',
+                '{"email": "nobody@example.com"}',
+                '{"username": "testuser", "password": "other"}',
+            ]
+        )
+    )
+    stdout, stderr = StringIO(), StringIO()
+    call_command(
+        "import_users",
+        str(path),
+        batch_size=2,
+        workers=2,
+        ignore_conflicts=True,
+        stdout=stdout,
+        stderr=stderr,
+    )
+    assert "Line 4: no username" in stderr.getvalue()
+    users = {user.username: user for user in User.objects.all()}
+    assert users["alice"].email == "alice@example.com"
+    assert users["alice"].check_password("alice-pass")
+    assert users["bob"].check_password("bob-pass")
+    assert not users["carol"].has_usable_password()
+    # Existing users are left alone
+    assert users["testuser"].check_password("password")
+
+
+@pytest.mark.django_db
+def test_schema_has_jwt_security_scheme():
+    response = APIClient().get("/api/schema/", HTTP_ACCEPT="application/vnd.oai.openapi+json")
+    assert response.status_code == 200
+    schema = json.loads(response.content)
+    assert schema["components"]["securitySchemes"]["jwtAuth"]["scheme"] == "bearer"
+    assert {"jwtAuth": []} in schema["paths"]["/api/orders/"]["get"]["security"]
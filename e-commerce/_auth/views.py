@@ -4,8 +4,13 @@ from rest_framework import serializers
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from .authentication import get_cached_user
+
 __all__ = (
     "SpectacularTokenObtainPairView",
     "SpectacularTokenRefreshView",
@@ -15,12 +20,31 @@ __all__ = (
 
 
 class SpectacularTokenObtainPairView(TokenObtainPairView):
+    throttle_scope = "auth"
+
     @extend_schema(summary="Obtain JWT token", tags=["auth"])
     def post(self, request, *args, **kwargs):
         return super().post(request, *args, **kwargs)
 
 
 class SpectacularTokenRefreshView(TokenRefreshView):
+    class ActiveUserTokenRefreshSerializer(TokenRefreshSerializer):
+        default_error_messages = {"no_active_account": "No active account found for the token"}
+
+        def validate(self, attrs):
+            # Access tokens aren't checked against the database, so deactivated users
+            # must not get new ones
+            refresh = self.token_class(attrs["refresh"])
+            user = get_cached_user(refresh.get(api_settings.USER_ID_CLAIM))
+            if not api_settings.USER_AUTHENTICATION_RULE(user):
+                raise AuthenticationFailed(
+                    self.error_messages["no_active_account"], "no_active_account"
+                )
+            return super().validate(attrs)
+
+    serializer_class = ActiveUserTokenRefreshSerializer
+    throttle_scope = "auth"
+
     @extend_schema(summary="Refresh JWT token", tags=["auth"])
     def post(self, request, *args, **kwargs):
         return super().post(request, *args, **kwargs)
@@ -64,11 +88,12 @@ class RegisterUserView(APIView):
             )
             ref_name = "RegisterUserSerializer"
 
+    throttle_scope = "auth"
+
     @extend_schema(summary="Register user", tags=["auth"], request=RegisterUserSerializer)
     def post(self, request):
         serializer = self.RegisterUserSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        user = User.objects.create_user(**serializer.validated_data)
-        user.set_password(serializer.validated_data["password"])
-        user.save()
+        # create_user() hashes the password and saves the user with a single INSERT
+        User.objects.create_user(**serializer.validated_data)
         return Response(status=201)
@@ -0,0 +1,53 @@
+"""
+Gunicorn settings for the API servers, tuned with environment variables.
+
+    gunicorn --config config/gunicorn.py config.wsgi
+
+Send HUP to the master to gracefully restart the workers with the new settings.
+The application is preloaded, so new code is picked up by a container restart or
+by a zero-downtime binary upgrade: USR2 starts a new master, then WINCH and TERM stop the old one.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Prefork workers, NUM_WORKERS should fit the CPU and memory limits of the container
+workers = int(os.environ.get("NUM_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# Threads let a worker keep idle upstream connections open and overlap IO waits.
+# The ASGI app runs with uvicorn_worker.UvicornWorker, one event loop per worker.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# Import Django once in the master, workers fork with the loaded app and start in milliseconds
+preload_app = True
+
+# Recycle workers to cap slow memory growth, the jitter keeps them from restarting together
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+timeout = int(os.environ.get("TIMEOUT", 180))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+# Longer than the nginx upstream keepalive_timeout, so nginx closes idle connections first
+# and never reuses a connection gunicorn has just closed
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 75))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    # Connections opened while preloading must not be shared between workers
+    from django.db import connections
+
+    connections.close_all()
+
+
+def child_exit(server, worker):
+    # Workers share Prometheus metrics through PROMETHEUS_MULTIPROC_DIR
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
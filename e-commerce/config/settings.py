@@ -41,7 +41,11 @@ SIMPLE_JWT = {
     "SIGNING_KEY": env.str("SECRET_KEY"),
     "AUTH_HEADER_TYPES": ("Bearer",),
     "AUTH_HEADER_NAME": "HTTP_AUTHORIZATION",
+    # Requests are authenticated by the signed claims, the user is loaded only when needed
+    "TOKEN_USER_CLASS": "_auth.authentication.CachedTokenUser",
 }
+# Cache timeout of users loaded by CachedTokenUser, entries are also dropped on save
+AUTH_USER_CACHE_TIMEOUT = env.int("AUTH_USER_CACHE_TIMEOUT", default=60)
 
 CORS_ALLOWED_ORIGINS = env.list("CORS_ALLOWED_ORIGINS", default=["http://localhost:80"])
 CORS_ALLOW_ALL_ORIGINS = env.bool("CORS_ALLOW_ALL_ORIGINS", default=False)
@@ -51,7 +55,7 @@ CORS_ALLOW_ALL_ORIGINS = env.bool("CORS_ALLOW_ALL_ORIGINS", default=False)
 DEBUG = env.bool("DEBUG", default=False)
 
 DEBUG_TOOLBAR_CONFIG = {
-    "SHOW_TOOLBAR_CALLBACK": lambda request: True,
+    "SHOW_TOOLBAR_CALLBACK": lambda request: DEBUG,
 }
 
 SPECTACULAR_SETTINGS = {
@@ -95,8 +99,8 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     # THIRD PARTY APPS
-    "debug_toolbar",
     "drf_spectacular",
     "rest_framework_simplejwt",
     "django_prometheus",
@@ -109,27 +113,101 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django_prometheus.middleware.PrometheusBeforeMiddleware",
+    "core.middleware.AdmissionControlMiddleware",
+    "core.middleware.QueryMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    # Skipped for API_PATH_PREFIX, see core.middleware.NonAPIMiddlewareMixin
+    "core.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
+    "core.middleware.CsrfViewMiddleware",
+    "core.middleware.AuthenticationMiddleware",
+    "core.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.middleware.ReplicaRoutingMiddleware",
+    "core.middleware.RateLimitHeadersMiddleware",
     # THIRD PARTY MIDDLEWARE
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
     "django_prometheus.middleware.PrometheusAfterMiddleware",
 ]
 
+# Paths of the JWT-only API, served without sessions, messages and CSRF middleware
+API_PATH_PREFIX = "/api/"
+
+# The debug toolbar is only loaded in development
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.insert(-1, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "_auth.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
     "PAGE_SIZE": 10,
+    "DEFAULT_THROTTLE_CLASSES": ("core.throttling.TokenBucketThrottle",),
+    # Bucket sizes, refilled evenly over the period, see core.throttling
+    "DEFAULT_THROTTLE_RATES": {
+        "user.read": env.str("THROTTLE_USER_READ_RATE", default="600/min"),
+        "user.write": env.str("THROTTLE_USER_WRITE_RATE", default="120/min"),
+        "anon.read": env.str("THROTTLE_ANON_READ_RATE", default="300/min"),
+        "anon.write": env.str("THROTTLE_ANON_WRITE_RATE", default="30/min"),
+        "auth": env.str("THROTTLE_AUTH_RATE", default="20/min"),
+    },
+    # nginx appends the client address to X-Forwarded-For
+    "NUM_PROXIES": env.int("NUM_PROXIES", default=1),
 }
 
+# Admission control, see core.admission
+# Queue delay plus response time above which a worker lowers its concurrency limit
+ADMISSION_LATENCY_TARGET = env.float("ADMISSION_LATENCY_TARGET", default=0.5)
+ADMISSION_INITIAL_LIMIT = env.int("ADMISSION_INITIAL_LIMIT", default=8)
+ADMISSION_MIN_LIMIT = env.int("ADMISSION_MIN_LIMIT", default=1)
+ADMISSION_MAX_LIMIT = env.int("ADMISSION_MAX_LIMIT", default=64)
+ADMISSION_LIMIT_BACKOFF = env.float("ADMISSION_LIMIT_BACKOFF", default=0.9)
+ADMISSION_RETRY_AFTER = env.int("ADMISSION_RETRY_AFTER", default=2)
+# Health checks and metrics scrapes are never shed
+ADMISSION_CONTROL_EXEMPT_PATHS = ("/health/", "/metrics")
+
+# A statement run this many times in one request is counted as an N+1, see QueryMetricsMiddleware
+QUERY_METRICS_DUPLICATE_THRESHOLD = env.int("QUERY_METRICS_DUPLICATE_THRESHOLD", default=5)
+
+# Throttling falls back to per-process buckets when Redis doesn't answer within this many seconds
+THROTTLE_REDIS_TIMEOUT = env.float("THROTTLE_REDIS_TIMEOUT", default=0.1)
+# and tries Redis again after this many seconds
+THROTTLE_REDIS_RETRY_INTERVAL = env.float("THROTTLE_REDIS_RETRY_INTERVAL", default=5.0)
+THROTTLE_LOCAL_MAX_BUCKETS = env.int("THROTTLE_LOCAL_MAX_BUCKETS", default=10000)
+
+# Cached rendered responses at least this long are also stored gzipped
+RESPONSE_CACHE_GZIP_MIN_LENGTH = env.int("RESPONSE_CACHE_GZIP_MIN_LENGTH", default=1024)
+
+# Per-object cache of detail views, entries are also invalidated by model signals
+OBJECT_CACHE_TIMEOUT = env.int("OBJECT_CACHE_TIMEOUT", default=60 * 5)
+# Expired cache entries are served for this long while one request recomputes them
+CACHE_STALE_TIMEOUT = env.int("CACHE_STALE_TIMEOUT", default=30)
+# Expiry of the recompute lock, in case the worker holding it dies
+CACHE_LOCK_TIMEOUT = env.int("CACHE_LOCK_TIMEOUT", default=10)
+# How long requests wait for a missing entry that another request computes
+CACHE_LOCK_WAIT = env.float("CACHE_LOCK_WAIT", default=0.5)
+
+# Cache warm-up, see core.warmup
+# Public scheme and host of the API, e.g. https://shop.example, required by the warm-up.
+# Links in cached responses are built from it and responses are cached per host.
+CACHE_WARMUP_BASE_URL = env.str("CACHE_WARMUP_BASE_URL", default="")
+# Requested URLs are counted in process and flushed to Redis this often
+CACHE_WARMUP_FLUSH_INTERVAL = env.float("CACHE_WARMUP_FLUSH_INTERVAL", default=10.0)
+# Hit counters are kept per day, for the hottest URLs of the last days
+CACHE_WARMUP_HISTORY_DAYS = env.int("CACHE_WARMUP_HISTORY_DAYS", default=2)
+CACHE_WARMUP_MAX_URLS = env.int("CACHE_WARMUP_MAX_URLS", default=10000)
+
+# Seconds nginx and browsers may reuse public catalog responses without revalidating them
+CATALOG_CACHE_MAX_AGE = env.int("CATALOG_CACHE_MAX_AGE", default=60)
+
+# Requests of an ASGI worker that query the database at once, each one holds a connection
+ASYNC_DB_CONCURRENCY = env.int("ASYNC_DB_CONCURRENCY", default=10)
+
+# Paginated counts at or above this value are estimated from PostgreSQL statistics
+PAGINATOR_ESTIMATED_COUNT_THRESHOLD = env.int("PAGINATOR_ESTIMATED_COUNT_THRESHOLD", default=10000)
+
 # STATICFILES SETTINGS
 # ------------------------------------------------------------------------------
 STATIC_URL = "static/"
@@ -162,6 +240,25 @@ DATABASES = {
         "PORT": env.str("POSTGRES_PORT"),
     }
 }
+# Read-only alias for the Patroni replicas (haproxy replica port), the primary by default.
+# Tests mirror it to the default database.
+DATABASES["replica"] = {
+    **DATABASES["default"],
+    "HOST": env.str("POSTGRES_REPLICA_HOST", default=DATABASES["default"]["HOST"]),
+    "PORT": env.str("POSTGRES_REPLICA_PORT", default=DATABASES["default"]["PORT"]),
+    "TEST": {"MIRROR": "default"},
+}
+DATABASE_ROUTERS = ["core.routers.ReplicaRouter"]
+
+# Send safe reads of catalog views to the replica
+REPLICA_READS_ENABLED = env.bool("REPLICA_READS_ENABLED", default=False)
+# How long a user reads from the primary after a write
+REPLICA_STICKY_SECONDS = env.int("REPLICA_STICKY_SECONDS", default=5)
+# Reads fall back to the primary while the replica lags more than this
+REPLICA_MAX_LAG_SECONDS = env.float("REPLICA_MAX_LAG_SECONDS", default=2.0)
+REPLICA_LAG_CHECK_INTERVAL = env.float("REPLICA_LAG_CHECK_INTERVAL", default=1.0)
+# Cache timeout of pages built from replica reads, which may miss the latest writes
+REPLICA_CACHE_TIMEOUT = env.int("REPLICA_CACHE_TIMEOUT", default=5)
 
 # CACHE SETTINGS
 # ------------------------------------------------------------------------------
@@ -169,8 +266,18 @@ CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.redis.RedisCache",
         "LOCATION": env.str("REDIS_URL"),
-    }
+    },
+    # In-process L1 of core.cache.TwoTierCache, one per worker process, LRU culled
+    "local": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "two-tier-l1",
+        "OPTIONS": {"MAX_ENTRIES": env.int("LOCAL_CACHE_MAX_ENTRIES", default=1000)},
+    },
 }
+# Longest life of an L1 entry, also bounds L1 copies of entries built from replica reads
+LOCAL_CACHE_TIMEOUT = env.int("LOCAL_CACHE_TIMEOUT", default=10)
+# How often a process polls Redis for generations bumped by other processes
+LOCAL_CACHE_VERSION_CHECK_INTERVAL = env.float("LOCAL_CACHE_VERSION_CHECK_INTERVAL", default=1.0)
 
 # INTERNALIZATION SETTINGS
 # ------------------------------------------------------------------------------
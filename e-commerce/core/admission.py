@@ -0,0 +1,97 @@
+import threading
+import time
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from rest_framework.permissions import SAFE_METHODS
+
+from .metrics import ADMISSION_CONCURRENCY_LIMIT
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+
+# Share of the concurrency limit and of the latency target a priority may use before
+# its requests are shed, high priority requests are never shed
+PRIORITY_SHARES = {HIGH: None, NORMAL: 0.8, LOW: 0.5}
+
+
+def get_request_priority(request):
+    """
+    `admission_priority` of the view class, otherwise normal for writes and requests
+    with credentials and low for anonymous reads. None for paths that are never shed.
+    """
+    if request.path_info.startswith(settings.ADMISSION_CONTROL_EXEMPT_PATHS):
+        return None
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return LOW
+    view_class = getattr(match.func, "cls", None) or getattr(match.func, "view_class", None)
+    priority = getattr(view_class, "admission_priority", None)
+    if priority is not None:
+        return priority
+    if request.method not in SAFE_METHODS or "HTTP_AUTHORIZATION" in request.META:
+        return NORMAL
+    return LOW
+
+
+def get_queue_delay(request):
+    """
+    Seconds since nginx received the request, from X-Request-Start: t=<msec>.
+    Includes the time spent in the gunicorn backlog and waiting for a worker thread.
+    """
+    header = request.META.get("HTTP_X_REQUEST_START", "")
+    try:
+        started = float(header.removeprefix("t="))
+    except ValueError:
+        return 0.0
+    # Clocks of the nginx and app hosts can disagree slightly
+    return max(0.0, time.time() - started)
+
+
+class AdmissionController:
+    """
+    AIMD concurrency limit of one worker process.
+
+    Every request under the latency target raises the limit by 1 / limit, so by one per limit
+    requests, and a request over it cuts the limit by ADMISSION_LIMIT_BACKOFF, at most once per
+    target interval so a burst of slow requests counts once. Latency includes the queue delay.
+
+    A request is admitted while the requests in flight stay under its share of the limit and its
+    queue delay under its share of the target. Shed requests return at once, which frees the
+    threads and the database for the requests that matter.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.limit = float(settings.ADMISSION_INITIAL_LIMIT)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._decreased_at = float("-inf")
+
+    def try_acquire(self, priority, queue_delay=0.0):
+        share = PRIORITY_SHARES[priority]
+        with self._lock:
+            if share is not None and (
+                self.in_flight >= max(1.0, self.limit * share)
+                or queue_delay > settings.ADMISSION_LATENCY_TARGET * share
+            ):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency):
+        with self._lock:
+            self.in_flight -= 1
+            if latency <= settings.ADMISSION_LATENCY_TARGET:
+                self.limit = min(settings.ADMISSION_MAX_LIMIT, self.limit + 1 / self.limit)
+            else:
+                now = self.clock()
+                if now - self._decreased_at < settings.ADMISSION_LATENCY_TARGET:
+                    return
+                self._decreased_at = now
+                self.limit = max(
+                    settings.ADMISSION_MIN_LIMIT, self.limit * settings.ADMISSION_LIMIT_BACKOFF
+                )
+            ADMISSION_CONCURRENCY_LIMIT.set(self.limit)
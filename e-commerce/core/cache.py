@@ -0,0 +1,519 @@
+import gzip
+import hashlib
+import re
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.mixins import ListModelMixin
+from rest_framework.renderers import JSONRenderer
+
+from .hits import record_hit
+from .metrics import TWO_TIER_CACHE_GETS
+from .routers import get_cache_timeout
+
+GENERATION_KEY_PREFIX = "generation"
+
+
+def _generation_key(model, pk=None):
+    if pk is None:
+        return f"{GENERATION_KEY_PREFIX}:{model._meta.label_lower}"
+    return f"{GENERATION_KEY_PREFIX}:{model._meta.label_lower}:{pk}"
+
+
+def _initial_generation():
+    """
+    Seed value for a generation counter.
+
+    Counters are seeded from the current time instead of 1, so a counter that
+    was evicted from Redis never starts again from a value that is already
+    baked into some cached key.
+    """
+    return int(time.time() * 1000)
+
+
+def _fetch_generations(keys):
+    generations = cache.get_many(keys)
+
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        for key in missing:
+            cache.add(key, _initial_generation(), timeout=None)
+        generations.update(cache.get_many(missing))
+    return generations
+
+
+def _generation_keys(models, pk):
+    keys = [_generation_key(model) for model in models]
+    if pk is not None:
+        keys.append(_generation_key(models[0], pk))
+    return keys
+
+
+def get_generations(*models, pk=None):
+    """
+    Return a token made of the current generation of every given model.
+    With `pk`, the generation of that object of the first model is part of it too,
+    it changes when the object is passed to invalidate_cached_objects().
+
+    All counters are read with a single round trip, the missing ones are
+    initialized on the fly.
+    """
+    keys = _generation_keys(models, pk)
+    generations = _fetch_generations(keys)
+    return ".".join(str(generations.get(key, 0)) for key in keys)
+
+
+def get_local_generations(*models, pk=None):
+    """
+    Same as get_generations(), but Redis is polled for the counters at most every
+    LOCAL_CACHE_VERSION_CHECK_INTERVAL seconds per process. Bumps made by other
+    processes are seen that late, the ones of this process immediately.
+    """
+    keys = _generation_keys(models, pk)
+    local_cache = caches["local"]
+    generations = local_cache.get_many(keys)
+
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        fetched = _fetch_generations(missing)
+        local_cache.set_many(fetched, settings.LOCAL_CACHE_VERSION_CHECK_INTERVAL)
+        generations.update(fetched)
+    return ".".join(str(generations.get(key, 0)) for key in keys)
+
+
+def bump_generation(model):
+    """
+    Invalidate every cached entry built on top of the model.
+
+    Old entries are not deleted, they just become unreachable and expire by TTL.
+    Should be called explicitly after queryset.update() and other bulk
+    operations, because they don't send model signals.
+    """
+    key = _generation_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_generation(), timeout=None)
+    caches["local"].delete(key)
+
+
+def canonical_query_hash(query_params, exclude=()):
+    """
+    Hash query parameters independently of their order in the query string.
+    """
+    items = sorted(
+        (key, value)
+        for key in query_params
+        if key not in exclude
+        for value in query_params.getlist(key)
+    )
+    return hashlib.md5(urlencode(items).encode()).hexdigest()
+
+
+_MISSING = object()
+
+
+class TwoTierCache:
+    """
+    In-process L1 cache (the "local" cache) in front of the shared Django cache (L2),
+    for small data read on nearly every request.
+
+    L1 can't be invalidated by other processes, so keys must change with the data, e.g.
+    contain get_local_generations(). L1 entries live at most LOCAL_CACHE_TIMEOUT seconds.
+    """
+
+    def get(self, key, default=None):
+        value = caches["local"].get(key, _MISSING)
+        if value is not _MISSING:
+            TWO_TIER_CACHE_GETS.labels("l1", "hit").inc()
+            return value
+        TWO_TIER_CACHE_GETS.labels("l1", "miss").inc()
+
+        value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            TWO_TIER_CACHE_GETS.labels("l2", "miss").inc()
+            return default
+        TWO_TIER_CACHE_GETS.labels("l2", "hit").inc()
+        caches["local"].set(key, value, settings.LOCAL_CACHE_TIMEOUT)
+        return value
+
+    def set(self, key, value, timeout):
+        cache.set(key, value, timeout)
+        caches["local"].set(key, value, min(timeout, settings.LOCAL_CACHE_TIMEOUT))
+
+
+two_tier_cache = TwoTierCache()
+
+
+LOCK_KEY_PREFIX = "lock"
+OBJECT_KEY_PREFIX = "object"
+
+_LOCK_POLL_INTERVAL = 0.02
+
+
+def _wait_for_entry(key):
+    deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(_LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def get_or_set_stale(key, compute, timeout, stale_timeout=None):
+    """
+    Cache-aside read with stampede protection, `compute()` builds the value on a miss.
+
+    Entries are kept for `stale_timeout` seconds after they expire. The first request
+    that finds an expired entry takes a lock and recomputes it, the other ones serve
+    the stale value meanwhile. On a miss the requests without the lock wait up to
+    CACHE_LOCK_WAIT seconds for the value before computing it themselves.
+    None is a valid value.
+    """
+    if stale_timeout is None:
+        stale_timeout = settings.CACHE_STALE_TIMEOUT
+    entry = cache.get(key)
+    if entry is not None and time.time() < entry[1]:
+        return entry[0]
+
+    lock_key = f"{LOCK_KEY_PREFIX}:{key}"
+    locked = cache.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT)
+    if not locked:
+        if entry is not None:
+            return entry[0]
+        entry = _wait_for_entry(key)
+        if entry is not None:
+            return entry[0]
+
+    try:
+        value = compute()
+        # After compute(), it decides whether the replica was used
+        timeout = get_cache_timeout(timeout)
+        cache.set(key, (value, time.time() + timeout), timeout + stale_timeout)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
+
+
+def get_object_cache_key(model, pk):
+    return f"{OBJECT_KEY_PREFIX}:{model._meta.label_lower}:{pk}"
+
+
+def get_cached_object(queryset, pk, timeout=None):
+    """
+    Return the object of the queryset with the given pk, or None, from the per-object cache.
+
+    Entries are shared by every queryset of the model, so it must not be filtered
+    by the request. Missing objects are cached too, creating them invalidates the entry.
+    """
+    return get_or_set_stale(
+        get_object_cache_key(queryset.model, pk),
+        lambda: queryset.filter(pk=pk).first(),
+        timeout or settings.OBJECT_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_cached_objects(model, pks):
+    """
+    Drop cached objects of the model and move their object generations, so their cached
+    detail responses are missed. Model signals do it on save and delete,
+    queryset.update() and other bulk operations must call it after commit.
+    """
+    generation_keys = [_generation_key(model, pk) for pk in pks]
+    # A deleted generation is seeded again from the current time
+    cache.delete_many([get_object_cache_key(model, pk) for pk in pks] + generation_keys)
+    caches["local"].delete_many(generation_keys)
+
+
+RESPONSE_KEY_PREFIX = "response:v2"
+
+# The same on hits and misses, the body depends on both
+RESPONSE_VARY = ("Accept", "Accept-Encoding")
+
+_accepts_gzip = re.compile(r"\bgzip\b")
+_accepts_json = re.compile(r"application/json|\*/\*")
+
+
+class CachedResponseMixin:
+    """
+    Cache the rendered JSON body of successful GET responses, optionally pre-gzipped,
+    with its validators. A hit is served from a single cache read, without touching the view,
+    the serializers or the renderer, and conditional requests are answered with 304.
+    The ETag set by ConditionalGetMixin is kept, otherwise it is a hash of the body.
+
+    Entries are keyed by scheme, host, path, query string and the generations of the serializer model
+    and `cache_dependencies`, so they are invalidated by the same hooks as cached pages.
+    Entries of CachedObjectMixin views depend on the generation of their object too, so
+    invalidate_cached_objects() alone invalidates them.
+    Like cached pages, entries built from replica reads live for REPLICA_CACHE_TIMEOUT.
+    Responses must not depend on the user.
+    """
+
+    response_cache_key = "rendered"
+    response_cache_timeout = 60 * 60 * 24
+    # Keep the entries in the process too, for small responses read on nearly every page
+    response_cache_local = False
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.response_is_cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        cache_key, response = self.get_cached_response(request)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if not self.cache_response(cache_key, response):
+                return response
+        else:
+            denied = self.check_cached_request(request, *args, **kwargs)
+            if denied is not None:
+                return denied
+        return self.get_conditional_response(request, response)
+
+    def check_cached_request(self, request, *args, **kwargs):
+        """
+        Authentication, permissions and throttles of APIView.initial() for a hit, which doesn't
+        run the view. Returns the error response, None when the hit may be served.
+        """
+        self.args, self.kwargs = args, kwargs
+        self.request = request = self.initialize_request(request, *args, **kwargs)
+        self.headers = self.default_response_headers
+        try:
+            self.perform_authentication(request)
+            self.check_permissions(request)
+            self.check_throttles(request)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+            return self.finalize_response(request, response, *args, **kwargs)
+        return None
+
+    def get_cached_response(self, request):
+        """
+        Returns the cache key of the request and the cached response, None on a miss.
+        """
+        record_hit(request)
+        cache_key = self.get_response_cache_key(request)
+        entry = self.get_response_cache().get(cache_key)
+        if entry is None:
+            return cache_key, None
+        return cache_key, self.build_cached_response(request, entry)
+
+    def cache_response(self, cache_key, response):
+        """
+        Caches a successful JSON response, returns whether it was cached.
+        """
+        if response.status_code != status.HTTP_200_OK or not isinstance(
+            getattr(response, "accepted_renderer", None), JSONRenderer
+        ):
+            return False
+        entry = self.build_response_cache_entry(response.render())
+        self.get_response_cache().set(
+            cache_key, entry, get_cache_timeout(self.response_cache_timeout)
+        )
+        response["ETag"] = entry["headers"]["ETag"]
+        patch_vary_headers(response, RESPONSE_VARY)
+        return True
+
+    @staticmethod
+    def get_conditional_response(request, response):
+        return get_conditional_response(
+            request,
+            etag=response["ETag"],
+            last_modified=parse_http_date_safe(response.get("Last-Modified")),
+            response=response,
+        )
+
+    def get_response_cache(self):
+        return two_tier_cache if self.response_cache_local else cache
+
+    @staticmethod
+    def response_is_cacheable(request):
+        # Other renderers, e.g. the browsable API, are rendered as usual
+        accept = request.headers.get("Accept", "")
+        return (
+            request.method in ("GET", "HEAD")
+            and request.GET.get("format", "json") == "json"
+            and (not accept or _accepts_json.search(accept) is not None)
+        )
+
+    def get_response_cache_key(self, request):
+        model = self.get_serializer_class().Meta.model
+        models = (model, *getattr(self, "cache_dependencies", ()))
+        pk = self.get_response_cache_object_pk()
+        if self.response_cache_local:
+            generations = get_local_generations(*models, pk=pk)
+        else:
+            generations = get_generations(*models, pk=pk)
+        query_hash = canonical_query_hash(request.GET)
+        # Pagination links are absolute, so the host and scheme are part of the body
+        return (
+            f"{RESPONSE_KEY_PREFIX}:{self.response_cache_key}:{request.scheme}:"
+            f"{request.get_host()}:{request.path}:{generations}:{query_hash}"
+        )
+
+    def get_response_cache_object_pk(self):
+        # The pk of the object of a detail view
+        if isinstance(self, CachedObjectMixin):
+            return self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return None
+
+    @staticmethod
+    def build_response_cache_entry(response):
+        body = response.content
+        headers = {"ETag": response.get("ETag") or f'"{hashlib.md5(body).hexdigest()}"'}
+        for header in ("Last-Modified", "Cache-Control"):
+            if header in response:
+                headers[header] = response[header]
+        entry = {
+            "body": body,
+            "gzip": None,
+            "headers": headers,
+            "content_type": response["Content-Type"],
+        }
+        if len(body) >= settings.RESPONSE_CACHE_GZIP_MIN_LENGTH:
+            # mtime=0 keeps the compressed bytes stable for the same body
+            entry["gzip"] = gzip.compress(body, mtime=0)
+        return entry
+
+    @staticmethod
+    def build_cached_response(request, entry):
+        body = entry["body"]
+        gzipped = entry["gzip"] is not None and _accepts_gzip.search(
+            request.headers.get("Accept-Encoding", "")
+        )
+        if gzipped:
+            body = entry["gzip"]
+        response = HttpResponse(body, content_type=entry["content_type"])
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+        for header, value in entry["headers"].items():
+            response[header] = value
+        patch_vary_headers(response, RESPONSE_VARY)
+        return response
+
+
+class NotModified(Exception):
+    """
+    Raised by ConditionalGetMixin to answer with 304 before the handler runs.
+    """
+
+
+class ConditionalGetMixin:
+    """
+    Conditional GET for DRF views with validators computed by a single aggregate query,
+    so a client with an up to date copy gets 304 before any row is loaded.
+
+    The validators of a detail come from `updated_at` of the object and of its
+    `validator_relations`, the ones of a list from max(updated_at) and the count of the
+    filtered queryset. Changes made with queryset.update() must set `updated_at` too.
+
+    Public views may be cached by nginx and browsers for CATALOG_CACHE_MAX_AGE seconds,
+    the other ones are private and revalidated on every request.
+    """
+
+    public_cache = False
+    validator_relations = ()
+    # For lists whose validators would cost as much as the page, e.g. the filtered catalog.
+    # The ETag is the hash of the body set by CachedResponseMixin, which answers conditional
+    # requests on hits.
+    validators_from_body = False
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # After authentication and permission checks, 304 must not bypass them
+        self.response_validators = {}
+        if request.method in ("GET", "HEAD"):
+            self.response_validators = self.get_validators() or {}
+            if get_conditional_response(request, **self.response_validators) is not None:
+                raise NotModified
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return HttpResponseNotModified()
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ("GET", "HEAD") and response.status_code in (
+            status.HTTP_200_OK,
+            status.HTTP_304_NOT_MODIFIED,
+        ):
+            validators = getattr(self, "response_validators", {})
+            if validators:
+                response["ETag"] = validators["etag"]
+                response["Last-Modified"] = http_date(validators["last_modified"])
+            patch_cache_control(response, **self.get_cache_control())
+        return response
+
+    def get_cache_control(self):
+        if self.public_cache:
+            return {"public": True, "max_age": settings.CATALOG_CACHE_MAX_AGE}
+        return {"private": True, "no_cache": True}
+
+    def get_validator_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        # Lists can have a pk in the URL too, e.g. reviews of a product
+        if isinstance(self, ListModelMixin) or lookup_url_kwarg not in self.kwargs:
+            return queryset
+        return queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+
+    def get_validators(self):
+        """
+        Return the `etag` and `last_modified` timestamp of the response, None when
+        there is nothing to validate, e.g. the object doesn't exist.
+        """
+        if self.validators_from_body:
+            return None
+        aggregates = {"last_modified": Max("updated_at"), "count": Count("pk", distinct=True)}
+        for relation in self.validator_relations:
+            aggregates[f"{relation}_last_modified"] = Max(f"{relation}__updated_at")
+            aggregates[f"{relation}_count"] = Count(relation, distinct=True)
+        values = self.get_validator_queryset().order_by().aggregate(**aggregates)
+        if values["last_modified"] is None:
+            return None
+        return self.build_validators(values)
+
+    @staticmethod
+    def build_validators(values):
+        # Counts change when rows are deleted, which doesn't move max(updated_at)
+        token = ":".join(str(value) for value in values.values())
+        last_modified = max(
+            value
+            for name, value in values.items()
+            if name.endswith("last_modified") and value is not None
+        )
+        return {
+            "etag": f'W/"{hashlib.md5(token.encode()).hexdigest()}"',
+            "last_modified": int(last_modified.timestamp()),
+        }
+
+
+class CachedObjectMixin:
+    """
+    Detail views that read the object from the per-object cache instead of the database.
+    With ConditionalGetMixin the validators come from the cached object too.
+    """
+
+    def get_object(self):
+        if not hasattr(self, "_object"):
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = self.get_queryset()
+            obj = get_cached_object(queryset, self.kwargs[lookup_url_kwarg])
+            if obj is None:
+                raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+            self.check_object_permissions(self.request, obj)
+            self._object = obj
+        return self._object
+
+    def get_validators(self):
+        obj = self.get_object()
+        return ConditionalGetMixin.build_validators({"last_modified": obj.updated_at, "count": 1})
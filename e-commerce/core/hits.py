@@ -0,0 +1,91 @@
+import datetime
+import threading
+import time
+from collections import Counter
+from functools import cache as memoize
+from logging import getLogger
+
+import redis
+from django.conf import settings
+
+logger = getLogger(__name__)
+
+HITS_KEY_PREFIX = "warmup:hits"
+
+
+@memoize
+def get_redis():
+    # Sorted sets aren't part of the Django cache API
+    return redis.Redis.from_url(settings.CACHES["default"]["LOCATION"])
+
+
+def _hits_key(day):
+    return f"{HITS_KEY_PREFIX}:{day:%Y%m%d}"
+
+
+class HitRecorder:
+    """
+    Per-process counters of requested cached URLs, flushed to a daily sorted set in Redis
+    at most every CACHE_WARMUP_FLUSH_INTERVAL seconds, so recording costs no round trip.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = Counter()
+        self._flushed_at = time.monotonic()
+
+    def record(self, url):
+        now = time.monotonic()
+        with self._lock:
+            self._hits[url] += 1
+            if now - self._flushed_at < settings.CACHE_WARMUP_FLUSH_INTERVAL:
+                return
+            hits, self._hits = self._hits, Counter()
+            self._flushed_at = now
+        self.flush(hits)
+
+    @staticmethod
+    def flush(hits):
+        key = _hits_key(datetime.date.today())
+        try:
+            with get_redis().pipeline(transaction=False) as pipeline:
+                for url, count in hits.items():
+                    pipeline.zincrby(key, count, url)
+                # Only the hottest URLs are kept
+                pipeline.zremrangebyrank(key, 0, -settings.CACHE_WARMUP_MAX_URLS - 1)
+                history = datetime.timedelta(days=settings.CACHE_WARMUP_HISTORY_DAYS + 1)
+                pipeline.expire(key, history)
+                pipeline.execute()
+        except redis.RedisError:
+            logger.exception("Failed to flush cache hit counters")
+
+
+hit_recorder = HitRecorder()
+
+
+def record_hit(request):
+    # Warm-up requests aren't traffic
+    if not getattr(request, "cache_warmup", False):
+        # Absolute, cached responses contain links built from the host
+        hit_recorder.record(request.build_absolute_uri())
+
+
+def get_hot_urls(limit):
+    """
+    The most requested URLs of the last CACHE_WARMUP_HISTORY_DAYS days, hottest first.
+    """
+    today = datetime.date.today()
+    keys = [
+        _hits_key(today - datetime.timedelta(days=days))
+        for days in range(settings.CACHE_WARMUP_HISTORY_DAYS)
+    ]
+    with get_redis().pipeline(transaction=False) as pipeline:
+        for key in keys:
+            pipeline.zrevrange(key, 0, limit - 1, withscores=True)
+        days = pipeline.execute()
+
+    hits = Counter()
+    for day in days:
+        for url, count in day:
+            hits[url.decode()] += count
+    return [url for url, _ in hits.most_common(limit)]
@@ -0,0 +1,92 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.middleware import AdmissionControlMiddleware
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+
+class Command(BaseCommand):
+    help = (
+        "Overload one simulated gthread worker with anonymous catalog reads and checkouts, "
+        "with and without AdmissionControlMiddleware. Requests run through the middleware "
+        "and the URL resolver, the database is a semaphore of --db-connections whose queries "
+        "take --slowdown times longer during the middle third of the run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=4, help="Threads of the worker")
+        parser.add_argument("--db-connections", type=int, default=2)
+        parser.add_argument("--query-time", type=float, default=0.01, help="Seconds per request")
+        parser.add_argument("--slowdown", type=float, default=5)
+        parser.add_argument("--rate", type=float, default=150, help="Requests per second")
+        parser.add_argument("--checkout-every", type=int, default=5, help="Every nth is checkout")
+        parser.add_argument("--duration", type=float, default=15)
+        parser.add_argument("--client-timeout", type=float, default=5, help="Clients give up")
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'Admission control':18} {'Request':9} {'sent':>6} {'ok':>6} {'shed':>6} "
+            f"{'timeout':>8} {'ok/s':>7} {'p50 s':>7} {'p99 s':>7}"
+        )
+        for enabled in (False, True):
+            results = self.run(enabled, options)
+            for kind in ("catalog", "checkout"):
+                self.report("on" if enabled else "off", kind, results[kind], options)
+
+    def run(self, enabled, options):
+        database = threading.Semaphore(options["db_connections"])
+        started = time.monotonic()
+        slow_from = started + options["duration"] / 3
+        slow_until = started + options["duration"] * 2 / 3
+
+        def backend(request):
+            with database:
+                now = time.monotonic()
+                slow = slow_from <= now < slow_until
+                time.sleep(options["query_time"] * (options["slowdown"] if slow else 1))
+            return HttpResponse()
+
+        handler = AdmissionControlMiddleware(backend) if enabled else backend
+        factory = RequestFactory()
+        results = {"catalog": [], "checkout": []}
+        lock = threading.Lock()
+
+        def serve(kind, request, arrived):
+            response = handler(request)
+            with lock:
+                results[kind].append((response.status_code, time.monotonic() - arrived))
+
+        with ThreadPoolExecutor(max_workers=options["threads"]) as worker:
+            count = int(options["rate"] * options["duration"])
+            for index in range(count):
+                time.sleep(max(0.0, started + index / options["rate"] - time.monotonic()))
+                if index % options["checkout_every"] == 0:
+                    kind = "checkout"
+                    request = factory.post(
+                        "/api/shopping-cart/order/", HTTP_AUTHORIZATION="Bearer token"
+                    )
+                else:
+                    kind = "catalog"
+                    request = factory.get("/api/products/")
+                # What nginx sets, the executor queue stands for the gunicorn backlog
+                request.META["HTTP_X_REQUEST_START"] = f"t={time.time():.3f}"
+                worker.submit(serve, kind, request, time.monotonic())
+        return results
+
+    def report(self, mode, kind, results, options):
+        timeout = options["client_timeout"]
+        ok = [latency for status, latency in results if status == 200 and latency <= timeout]
+        shed = sum(status == 503 for status, _ in results)
+        timed_out = sum(status == 200 and latency > timeout for status, latency in results)
+        p50 = p99 = float("nan")
+        if len(ok) > 1:
+            percentiles = statistics.quantiles(ok, n=100)
+            p50, p99 = percentiles[49], percentiles[98]
+        self.stdout.write(
+            f"{mode:18} {kind:9} {len(results):>6} {len(ok):>6} {shed:>6} {timed_out:>8} "
+            f"{len(ok) / options['duration']:>7.1f} {p50:>7.3f} {p99:>7.3f}"
+        )
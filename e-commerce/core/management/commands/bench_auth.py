@@ -0,0 +1,62 @@
+import time
+import uuid
+
+from _auth.authentication import CachedJWTAuthentication
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+ENDPOINTS = ("/api/shopping-cart/", "/api/wishlist/", "/api/orders/", "/api/auth/user/")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare database queries and time per authenticated request of JWTAuthentication "
+        "and CachedJWTAuthentication. Creates and removes its own user."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.create_user(username=f"bench-auth-{uuid.uuid4().hex}")
+        token = AccessToken.for_user(user)
+        factory = APIRequestFactory()
+        try:
+            self.stdout.write(
+                f"{'Endpoint':22} {'Authentication':24} {'queries/request':>16} {'ms/request':>11}"
+            )
+            for path in ENDPOINTS:
+                view = resolve(path).func
+                for authentication_class in (JWTAuthentication, CachedJWTAuthentication):
+                    queries, elapsed = self.measure(
+                        view, authentication_class, factory, path, token, options["requests"]
+                    )
+                    self.stdout.write(
+                        f"{path:22} {authentication_class.__name__:24} "
+                        f"{queries / options['requests']:>16.2f} "
+                        f"{elapsed / options['requests'] * 1000:>11.2f}"
+                    )
+        finally:
+            user.delete()
+
+    @staticmethod
+    def measure(view, authentication_class, factory, path, token, requests):
+        previous = view.cls.authentication_classes
+        view.cls.authentication_classes = [authentication_class]
+        try:
+            # Fills the cart, the wishlist and the cached user
+            view(factory.get(path, HTTP_AUTHORIZATION=f"Bearer {token}"))
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for _ in range(requests):
+                    view(factory.get(path, HTTP_AUTHORIZATION=f"Bearer {token}"))
+                elapsed = time.perf_counter() - started
+        finally:
+            view.cls.authentication_classes = previous
+        return len(queries), elapsed
@@ -0,0 +1,67 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+# The middleware that core.middleware subclasses to skip API paths
+FULL_CHAIN = {
+    "core.middleware.SessionMiddleware": "django.contrib.sessions.middleware.SessionMiddleware",
+    "core.middleware.CsrfViewMiddleware": "django.middleware.csrf.CsrfViewMiddleware",
+    "core.middleware.AuthenticationMiddleware": (
+        "django.contrib.auth.middleware.AuthenticationMiddleware"
+    ),
+    "core.middleware.MessageMiddleware": "django.contrib.messages.middleware.MessageMiddleware",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the time per request of API paths through the full middleware chain with the "
+        "debug toolbar, as before the lean profile, and through settings.MIDDLEWARE."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", default=["/api/categories/tree/", "/api/products/"])
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=7)
+
+    def handle(self, *args, **options):
+        full = [FULL_CHAIN.get(path, path) for path in settings.MIDDLEWARE]
+        if "debug_toolbar.middleware.DebugToolbarMiddleware" not in full:
+            full.insert(-1, "debug_toolbar.middleware.DebugToolbarMiddleware")
+        profiles = {"full": full, "lean": settings.MIDDLEWARE}
+        # Throttling would answer most of the requests with 429
+        unthrottled = {
+            **settings.REST_FRAMEWORK,
+            "DEFAULT_THROTTLE_RATES": {
+                scope: "1000000/s" for scope in settings.REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"]
+            },
+        }
+
+        for path in options["paths"]:
+            clients = {}
+            for name, middleware in profiles.items():
+                with override_settings(MIDDLEWARE=middleware):
+                    # The middleware chain is loaded by the first request of a client
+                    clients[name] = Client()
+                    clients[name].get(path)
+            # Interleaved, so drift of Redis and Postgres latency affects both profiles
+            timings = {name: [] for name in profiles}
+            with override_settings(REST_FRAMEWORK=unthrottled):
+                for _ in range(options["repeat"]):
+                    for name, client in clients.items():
+                        timings[name].append(self.measure(client, path, options["requests"]))
+            for name in profiles:
+                self.stdout.write(
+                    f"{path:32} {name:5} {min(timings[name]) * 1e6:>8.1f} µs/request"
+                )
+            saved = min(timings["full"]) - min(timings["lean"])
+            self.stdout.write(f"{path:32} saved {saved * 1e6:>8.1f} µs/request")
+
+    @staticmethod
+    def measure(client, path, requests):
+        started = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        return (time.perf_counter() - started) / requests
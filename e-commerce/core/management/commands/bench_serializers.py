@@ -0,0 +1,69 @@
+import time
+
+from core.models.products import Category, Product
+from core.serializers import ValuesSerializer
+from core.views.products import ProductSerializer
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows/sec of ProductSerializer over model instances with the values() "
+        "fast path, with and without the query. Creates and removes its own products."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        category = Category.objects.create(name="Serializer benchmark")
+        Product.objects.bulk_create(
+            Product(
+                name=f"Product {i}",
+                description="Serializer benchmark",
+                price=f"{i % 1000}.99",
+                stock_quantity=i % 10,
+                category=category,
+            )
+            for i in range(options["rows"])
+        )
+        queryset = Product.objects.filter(category=category).order_by("id")
+        values = ValuesSerializer.for_serializer(ProductSerializer)
+        try:
+            instances = list(queryset)
+            rows = list(values.values(queryset))
+            if ProductSerializer(instances, many=True).data != values.to_representation(rows):
+                raise CommandError("The fast path output differs from ProductSerializer")
+
+            self.report(
+                "ModelSerializer, serialization only",
+                lambda: ProductSerializer(instances, many=True).data,
+                options,
+            )
+            self.report(
+                "ValuesSerializer, serialization only",
+                lambda: values.to_representation(rows),
+                options,
+            )
+            self.report(
+                "ModelSerializer, query + serialization",
+                lambda: ProductSerializer(list(queryset), many=True).data,
+                options,
+            )
+            self.report(
+                "ValuesSerializer, query + serialization",
+                lambda: values.to_representation(values.values(queryset)),
+                options,
+            )
+        finally:
+            category.delete()
+
+    def report(self, name, run, options):
+        timings = []
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        self.stdout.write(f"{name:42} {options['rows'] / best:>12,.0f} rows/s")
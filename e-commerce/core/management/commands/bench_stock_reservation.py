@@ -0,0 +1,69 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.models.products import Category, Product
+from core.stock import InsufficientStock, reserve_stock
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer a single hot product with concurrent checkouts "
+        "and report throughput and oversell. Creates and removes its own product."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stock", type=int, default=500)
+        parser.add_argument("--checkouts", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument("--quantity", type=int, default=1)
+
+    def handle(self, *args, **options):
+        category = Category.objects.create(name="Stock reservation benchmark")
+        product = Product.objects.create(
+            name="Hot product",
+            description="Stock reservation benchmark",
+            price=1,
+            stock_quantity=options["stock"],
+            category=category,
+        )
+        reserved = []
+        rejected = []
+        lock = threading.Lock()
+
+        def checkout(_):
+            try:
+                with transaction.atomic():
+                    reserve_stock({product.pk: options["quantity"]})
+                outcome = reserved
+            except InsufficientStock:
+                outcome = rejected
+            finally:
+                connection.close()
+            with lock:
+                outcome.append(1)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            list(executor.map(checkout, range(options["checkouts"])))
+        elapsed = time.perf_counter() - started
+
+        product.refresh_from_db()
+        sold = len(reserved) * options["quantity"]
+        oversold = max(sold - options["stock"], 0)
+        category.delete()
+
+        self.stdout.write(f"Checkouts:   {options['checkouts']} ({options['concurrency']} concurrent)")
+        self.stdout.write(f"Elapsed:     {elapsed:.2f}s")
+        self.stdout.write(f"Throughput:  {options['checkouts'] / elapsed:.0f} checkouts/s")
+        self.stdout.write(f"Reserved:    {len(reserved)}")
+        self.stdout.write(f"Rejected:    {len(rejected)}")
+        self.stdout.write(f"Stock left:  {product.stock_quantity}")
+        self.stdout.write(f"Oversold:    {oversold}")
+
+        if oversold or product.stock_quantity != options["stock"] - sold:
+            self.stderr.write(self.style.ERROR("Stock is inconsistent"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No oversell"))
@@ -0,0 +1,149 @@
+import http.client
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Siege-style load test: every simulated user requests the URLs in turn --reps times. "
+        "Reports the same summary as `siege -b` plus latency percentiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+")
+        parser.add_argument("-c", "--concurrency", type=int, default=25)
+        parser.add_argument("-r", "--reps", type=int, default=10)
+        parser.add_argument(
+            "-H", "--header", action="append", default=[], help="Extra header, 'Name: value'"
+        )
+        parser.add_argument(
+            "--keep-alive",
+            action="store_true",
+            help="Reuse one connection per user instead of connecting for every request",
+        )
+        parser.add_argument(
+            "--send-delay",
+            type=float,
+            default=0,
+            help="Seconds to stall before finishing the request headers, simulates slow clients",
+        )
+
+    def handle(self, *args, **options):
+        urls = [urlsplit(url) for url in options["urls"]]
+        if any(url.scheme not in ("http", "https") or not url.netloc for url in urls):
+            raise CommandError("URLs must be absolute http(s) URLs")
+        if options["send_delay"] and (
+            options["keep_alive"] or any(url.scheme == "https" for url in urls)
+        ):
+            raise CommandError("--send-delay works only with plain http and new connections")
+        headers = {}
+        for header in options["header"]:
+            name, _, value = header.partition(":")
+            headers[name.strip()] = value.strip()
+
+        latencies = []
+        failures = []
+        transferred = [0]
+        lock = threading.Lock()
+
+        def connect(url):
+            if url.scheme == "https":
+                return http.client.HTTPSConnection(url.netloc, timeout=60)
+            return http.client.HTTPConnection(url.netloc, timeout=60)
+
+        def get(connection, url):
+            path = url.path or "/"
+            if url.query:
+                path = f"{path}?{url.query}"
+            if options["send_delay"]:
+                return slow_get(connection, path)
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+
+        def slow_get(connection, path):
+            lines = [f"GET {path} HTTP/1.1", f"Host: {connection.host}:{connection.port}"]
+            lines += [f"{name}: {value}" for name, value in headers.items()]
+            lines.append("Connection: close")
+            connection.connect()
+            connection.sock.sendall(("\r\n".join(lines) + "\r\n").encode())
+            time.sleep(options["send_delay"])
+            connection.sock.sendall(b"\r\n")
+            response = http.client.HTTPResponse(connection.sock)
+            response.begin()
+            return response.status, response.read()
+
+        def user(index):
+            if options["send_delay"]:
+                # Spread the stalls, simultaneous ones would overlap in the socket backlog
+                time.sleep(index * options["send_delay"] / options["concurrency"])
+            connection = None
+            for rep in range(options["reps"]):
+                url = urls[(index + rep) % len(urls)]
+                reused = connection is not None
+                if not reused:
+                    connection = connect(url)
+                started = time.perf_counter()
+                try:
+                    try:
+                        status, body = get(connection, url)
+                    except ConnectionError:
+                        if not reused:
+                            raise
+                        # The server closed an idle keep-alive connection, retry like browsers do
+                        connection.close()
+                        connection = connect(url)
+                        status, body = get(connection, url)
+                except (OSError, http.client.HTTPException) as e:
+                    status, body = repr(e), b""
+                    connection.close()
+                    connection = None
+                elapsed = time.perf_counter() - started
+                if not options["keep_alive"] and connection is not None:
+                    connection.close()
+                    connection = None
+                with lock:
+                    if isinstance(status, int) and status < 400:
+                        latencies.append(elapsed)
+                        transferred[0] += len(body)
+                    else:
+                        failures.append(status)
+            if connection is not None:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            list(executor.map(user, range(options["concurrency"])))
+        elapsed = time.perf_counter() - started
+        self.report(latencies, failures, transferred[0], elapsed)
+
+    def report(self, latencies, failures, transferred, elapsed):
+        transactions = len(latencies)
+        total = max(transactions + len(failures), 1)
+        self.stdout.write(f"Transactions:            {transactions} hits")
+        self.stdout.write(f"Availability:            {transactions / total * 100:.2f} %")
+        self.stdout.write(f"Elapsed time:            {elapsed:.2f} secs")
+        self.stdout.write(f"Data transferred:        {transferred / 1024 / 1024:.2f} MB")
+        if len(latencies) > 1:
+            percentiles = statistics.quantiles(latencies, n=100)
+            self.stdout.write(f"Response time:           {statistics.mean(latencies):.3f} secs")
+            self.stdout.write(f"Transaction rate:        {transactions / elapsed:.2f} trans/sec")
+            self.stdout.write(
+                f"Throughput:              {transferred / 1024 / 1024 / elapsed:.2f} MB/sec"
+            )
+            self.stdout.write(f"Concurrency:             {sum(latencies) / elapsed:.2f}")
+            self.stdout.write(f"Longest transaction:     {max(latencies):.3f}")
+            self.stdout.write(f"Shortest transaction:    {min(latencies):.3f}")
+            self.stdout.write(
+                f"Latency p50/p95/p99:     {percentiles[49]:.3f} / {percentiles[94]:.3f} / "
+                f"{percentiles[98]:.3f} secs"
+            )
+        self.stdout.write(f"Successful transactions: {transactions}")
+        self.stdout.write(f"Failed transactions:     {len(failures)}")
+        if failures:
+            self.stderr.write(f"First failures: {failures[:5]}")
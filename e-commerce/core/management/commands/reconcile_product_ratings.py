@@ -0,0 +1,73 @@
+from decimal import Decimal
+from functools import partial
+
+from core.cache import bump_generation, invalidate_cached_objects
+from core.models.products import Product, Review
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def _review_aggregate(aggregate):
+    return Coalesce(
+        Subquery(
+            Review.objects.filter(product=OuterRef("pk"))
+            .values("product")
+            .annotate(value=aggregate)
+            .values("value"),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+class Command(BaseCommand):
+    help = "Recalculate denormalized product ratings that drifted from the reviews."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drifted = (
+            Product.objects.annotate(
+                actual_sum=_review_aggregate(Sum("rating")),
+                actual_count=_review_aggregate(Count("id")),
+            )
+            .filter(~Q(rating_sum=F("actual_sum")) | ~Q(rating_count=F("actual_count")))
+            .only("id")
+        )
+
+        batch = []
+        fixed = []
+        now = timezone.now()
+        for product in drifted.iterator(chunk_size=options["batch_size"]):
+            product.rating_sum = product.actual_sum
+            product.rating_count = product.actual_count
+            product.rating_avg = (
+                (Decimal(product.actual_sum) / product.actual_count).quantize(Decimal("0.01"))
+                if product.actual_count
+                else Decimal(0)
+            )
+            # Validators of conditional GET come from updated_at
+            product.updated_at = now
+            batch.append(product)
+            if len(batch) >= options["batch_size"]:
+                fixed += self._save(batch)
+        fixed += self._save(batch)
+
+        if fixed:
+            # bulk_update doesn't send signals, ratings are shown and sorted by in lists too
+            transaction.on_commit(partial(bump_generation, Product))
+            transaction.on_commit(partial(invalidate_cached_objects, Product, fixed))
+        self.stdout.write(self.style.SUCCESS(f"Reconciled ratings of {len(fixed)} products"))
+
+    @staticmethod
+    def _save(batch):
+        Product.objects.bulk_update(
+            batch, ["rating_sum", "rating_count", "rating_avg", "updated_at"]
+        )
+        pks = [product.pk for product in batch]
+        batch.clear()
+        return pks
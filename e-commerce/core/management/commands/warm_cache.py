@@ -0,0 +1,44 @@
+import time
+
+from core.warmup import warm_cache
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the caches of the most requested catalog URLs, ranked by recorded hits, "
+        "then of the category tree, the first list pages and the top-selling products."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=200, help="Hottest URLs to warm")
+        parser.add_argument("--pages", type=int, default=5, help="First pages of each list")
+        parser.add_argument("--products", type=int, default=50, help="Top-selling products")
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--budget", type=float, default=60, help="Seconds to start warming")
+        parser.add_argument(
+            "--base-url",
+            default=settings.CACHE_WARMUP_BASE_URL,
+            help="Public scheme and host of the API, links in cached responses are built from it. "
+            "Default: CACHE_WARMUP_BASE_URL",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            warmed, skipped = warm_cache(
+                options["limit"],
+                options["pages"],
+                options["products"],
+                options["concurrency"],
+                options["budget"],
+                options["base_url"],
+            )
+        except ImproperlyConfigured as exc:
+            raise CommandError(exc)
+        self.stdout.write(
+            f"Warmed {warmed} URLs in {time.perf_counter() - started:.2f}s, "
+            f"{skipped} skipped by the time budget"
+        )
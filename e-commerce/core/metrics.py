@@ -0,0 +1,40 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Hit ratio of a tier: hits / (hits + misses), L2 is read only on L1 misses
+TWO_TIER_CACHE_GETS = Counter(
+    "two_tier_cache_gets_total",
+    "Reads of TwoTierCache by tier (l1, l2) and result (hit, miss)",
+    ["tier", "result"],
+)
+
+# Requests answered with 503 by AdmissionControlMiddleware, by priority (normal, low)
+ADMISSION_SHED = Counter(
+    "admission_shed_total",
+    "Requests shed by admission control by priority",
+    ["priority"],
+)
+ADMISSION_CONCURRENCY_LIMIT = Gauge(
+    "admission_concurrency_limit",
+    "AIMD concurrency limit of the worker",
+    multiprocess_mode="liveall",
+)
+
+# Per request SQL of QueryMetricsMiddleware, by resolved view name and method
+VIEW_DB_QUERIES = Histogram(
+    "django_view_db_queries",
+    "SQL queries per request by view",
+    ["view", "method"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500),
+)
+VIEW_DB_QUERY_SECONDS = Histogram(
+    "django_view_db_query_seconds",
+    "Total SQL time per request by view",
+    ["view", "method"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+VIEW_DB_DUPLICATE_QUERIES = Counter(
+    "django_view_db_duplicate_queries_total",
+    "Requests that ran the same SQL statement QUERY_METRICS_DUPLICATE_THRESHOLD times or more, "
+    "usually an N+1",
+    ["view", "method"],
+)
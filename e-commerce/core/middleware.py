@@ -0,0 +1,288 @@
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from logging import getLogger
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import JsonResponse
+from django.middleware import csrf
+from django.utils.deprecation import MiddlewareMixin
+from django.views import View
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+
+from .admission import AdmissionController, get_queue_delay, get_request_priority
+from .metrics import (
+    ADMISSION_SHED,
+    VIEW_DB_DUPLICATE_QUERIES,
+    VIEW_DB_QUERIES,
+    VIEW_DB_QUERY_SECONDS,
+)
+from .routers import (
+    ReplicaRoutingState,
+    get_routing_state,
+    mark_sticky,
+    reset_routing_state,
+    set_routing_state,
+)
+
+logger = getLogger(__name__)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Allows reads from the replica in safe requests to views with `replica_reads = True`
+    and pins users to the primary for REPLICA_STICKY_SECONDS after a successful write.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = set_routing_state(ReplicaRoutingState(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_routing_state(token)
+
+        if request.method not in SAFE_METHODS:
+            self.stick_writer(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = set_routing_state(ReplicaRoutingState(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            reset_routing_state(token)
+
+        if request.method not in SAFE_METHODS:
+            # Resolving a lazy user queries the database
+            await sync_to_async(self.stick_writer)(request, response)
+        return response
+
+    @staticmethod
+    def stick_writer(request, response):
+        if response.status_code >= 400:
+            return
+        # DRF authenticates inside the view and copies the user to the Django request
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            mark_sticky(user.pk)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, "cls", None) or getattr(view_func, "view_class", None)
+        state = get_routing_state()
+        if state is not None:
+            state.replica_allowed = request.method in SAFE_METHODS and getattr(
+                view_class, "replica_reads", False
+            )
+        return None
+
+
+class RateLimitHeadersMiddleware(MiddlewareMixin):
+    """
+    Adds the RateLimit-* headers of the IETF draft for the bucket of
+    core.throttling.TokenBucketThrottle that checked the request.
+    """
+
+    def process_response(self, request, response):
+        rate_limit = getattr(request, "rate_limit", None)
+        if rate_limit is not None:
+            response["RateLimit-Limit"] = str(rate_limit.limit)
+            response["RateLimit-Remaining"] = str(rate_limit.remaining)
+            response["RateLimit-Reset"] = str(rate_limit.reset)
+            response["RateLimit-Policy"] = f"{rate_limit.limit};w={rate_limit.period}"
+        return response
+
+
+class AdmissionControlMiddleware:
+    """
+    Sheds low priority requests with 503 and Retry-After while the worker is overloaded,
+    see core.admission.AdmissionController. Goes first, shed requests cost no other middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.controller = AdmissionController()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        priority = get_request_priority(request)
+        if priority is None:
+            return self.get_response(request)
+        queue_delay = get_queue_delay(request)
+        if not self.controller.try_acquire(priority, queue_delay):
+            return self.shed(priority)
+        started = time.monotonic()
+        try:
+            return self.get_response(request)
+        finally:
+            self.controller.release(queue_delay + time.monotonic() - started)
+
+    async def __acall__(self, request):
+        priority = get_request_priority(request)
+        if priority is None:
+            return await self.get_response(request)
+        queue_delay = get_queue_delay(request)
+        if not self.controller.try_acquire(priority, queue_delay):
+            return self.shed(priority)
+        started = time.monotonic()
+        try:
+            return await self.get_response(request)
+        finally:
+            self.controller.release(queue_delay + time.monotonic() - started)
+
+    @staticmethod
+    def shed(priority):
+        ADMISSION_SHED.labels(priority).inc()
+        response = JsonResponse(
+            {"detail": "The server is overloaded, retry later."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+        response["Retry-After"] = str(settings.ADMISSION_RETRY_AFTER)
+        return response
+
+
+class QueryRecorder:
+    """
+    execute_wrapper() of the connections of a request, counts the queries, their time
+    and how often each statement ran. Statements are compared before parameters are bound,
+    so a query repeated for every row of a list counts as one statement.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+
+# The exit stack and recorder of the current request, for connections opened during it
+_query_recording = ContextVar("query_recording", default=None)
+
+
+def record_new_connection_queries(sender, connection, **kwargs):
+    recording = _query_recording.get()
+    if recording is not None:
+        stack, recorder = recording
+        # Also sent when a wrapped connection reconnects
+        if recorder not in connection.execute_wrappers:
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+
+connection_created.connect(record_new_connection_queries, dispatch_uid="core:query_metrics")
+
+
+class QueryMetricsMiddleware:
+    """
+    Records the SQL queries of every request in Prometheus, labeled by the resolved view name
+    and method: their number, total time and whether a statement repeated often enough to be
+    an N+1. Only the sync stack is instrumented, the async ORM queries from other threads.
+
+    Connections of the thread that already exist are wrapped up front, others when the request
+    opens them, so aliases the request doesn't use, e.g. the replica, aren't set up.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all(initialized_only=True):
+                stack.enter_context(connection.execute_wrapper(recorder))
+            token = _query_recording.set((stack, recorder))
+            try:
+                response = self.get_response(request)
+            finally:
+                _query_recording.reset(token)
+        self.record(request, recorder)
+        return response
+
+    @staticmethod
+    def record(request, recorder):
+        resolver_match = getattr(request, "resolver_match", None)
+        view = resolver_match.view_name if resolver_match is not None else "<unresolved>"
+        # Clients can send any verb, unknown ones share a label to bound the series
+        method = request.method if request.method.lower() in View.http_method_names else "other"
+        VIEW_DB_QUERIES.labels(view, method).observe(recorder.count)
+        VIEW_DB_QUERY_SECONDS.labels(view, method).observe(recorder.duration)
+        if not recorder.statements:
+            return
+        sql, repeats = recorder.statements.most_common(1)[0]
+        if repeats >= settings.QUERY_METRICS_DUPLICATE_THRESHOLD:
+            VIEW_DB_DUPLICATE_QUERIES.labels(view, method).inc()
+            logger.info("%s %s ran %d times: %s", method, view, repeats, sql[:500])
+
+
+class NonAPIMiddlewareMixin:
+    """
+    Skips a middleware for paths under API_PATH_PREFIX. The API authenticates with JWT only,
+    so sessions, messages and the Django user aren't needed there and DRF views are CSRF
+    exempt. The admin and the schema UI keep the full chain.
+    """
+
+    def __call__(self, request):
+        if request.path_info.startswith(settings.API_PATH_PREFIX):
+            # A coroutine in the async stack, like MiddlewareMixin.__call__
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+# Subclasses, so the system checks of the admin still find them
+class SessionMiddleware(NonAPIMiddlewareMixin, sessions_middleware.SessionMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(NonAPIMiddlewareMixin, csrf.CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if request.path_info.startswith(settings.API_PATH_PREFIX):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class AuthenticationMiddleware(NonAPIMiddlewareMixin, auth_middleware.AuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(NonAPIMiddlewareMixin, messages_middleware.MessageMiddleware):
+    pass
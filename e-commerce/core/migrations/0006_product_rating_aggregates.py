@@ -0,0 +1,56 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:08
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    Review = apps.get_model('core', 'Review')
+    # Ratings weren't validated, averages above 9.99 don't fit rating_avg
+    Review.objects.filter(rating__lt=1).update(rating=1)
+    Review.objects.filter(rating__gt=5).update(rating=5)
+
+    def aggregate(expression, output_field):
+        reviews = Review.objects.filter(product=OuterRef('pk')).values('product')
+        return Coalesce(
+            Subquery(reviews.annotate(value=expression).values('value'), output_field=output_field),
+            Value(0),
+        )
+
+    Product.objects.update(
+        rating_sum=aggregate(Sum('rating'), IntegerField()),
+        rating_count=aggregate(Count('id'), IntegerField()),
+        rating_avg=aggregate(Avg('rating'), models.DecimalField(max_digits=3, decimal_places=2)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=3, verbose_name='Average rating'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Number of ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, verbose_name='Sum of ratings'),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating_avg', 'id'], name='core_produc_rating__098372_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:09
+
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Category = apps.get_model('core', 'Category')
+
+    paths = {}
+    depth = 0
+    level = list(Category.objects.filter(parent_category=None))
+    while level:
+        for category in level:
+            parent_path = paths.get(category.parent_category_id, '')
+            category.path = f'{parent_path}{category.pk}/'
+            category.depth = depth
+            paths[category.pk] = category.path
+        Category.objects.bulk_update(level, ['path', 'depth'])
+        level = list(Category.objects.filter(parent_category__in=[category.pk for category in level]))
+        depth += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='core_category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('english', coalesce({table}.name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce({table}.description, '')), 'B')
+"""
+
+CREATE_TRIGGER = f"""
+CREATE FUNCTION core_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR.format(table='NEW')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_product_search_vector_trigger
+BEFORE INSERT OR UPDATE OF name, description ON core_product
+FOR EACH ROW EXECUTE FUNCTION core_product_search_vector_update();
+
+UPDATE core_product SET search_vector = {SEARCH_VECTOR.format(table='core_product')};
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER core_product_search_vector_trigger ON core_product;
+DROP FUNCTION core_product_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_category_materialized_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='core_produc_search__e02340_gin'),
+        ),
+    ]
@@ -1,5 +1,10 @@
+from decimal import Decimal
+
 from core.utils import TimeStampedModel
 from django.db import models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from .products import Product
 
@@ -20,6 +25,21 @@ class Order(TimeStampedModel):
             self.total_price = sum(item.price for item in self.items.all())
         super().save(*args, **kwargs)
 
+    def update_total_price(self):
+        """
+        Recalculate the total price with a single UPDATE aggregating the order items in SQL.
+        """
+        total_price = (
+            OrderItem.objects.filter(order=OuterRef("pk"))
+            .values("order")
+            .annotate(total=Sum("price"))
+            .values("total")
+        )
+        Order.objects.filter(pk=self.pk).update(
+            total_price=Coalesce(Subquery(total_price), Value(Decimal(0))),
+            updated_at=timezone.now(),
+        )
+
     def __str__(self):
         return f"Order #{self.pk} for {self.user.email}"
 
@@ -1,5 +1,16 @@
+from decimal import Decimal
+from functools import partial
+
+from core.cache import bump_generation, invalidate_cached_objects
 from core.utils import TimeStampedModel
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Value, When
+from django.db.models.functions import Cast, Concat, Substr
+from django.utils import timezone
 
 
 class Category(TimeStampedModel):
@@ -12,13 +23,57 @@ class Category(TimeStampedModel):
         verbose_name="Parent category",
         related_name="subcategories",
     )
+    # Materialized path of ids from the root, e.g. "1/5/12/".
+    # Subtree of a category is every category whose path starts with its path.
+    path = models.CharField(max_length=255, editable=False, default="")
+    depth = models.PositiveSmallIntegerField(editable=False, default=0)
 
     def __str__(self):
         return self.name
 
+    def clean(self):
+        parent = self.parent_category
+        if self.pk and self.path and parent and parent.path.startswith(self.path):
+            raise ValidationError({"parent_category": "Category can't be moved into its subtree"})
+
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        self.clean()
+        previous_path = self.path
+        super().save(*args, **kwargs)
+
+        parent = self.parent_category
+        path = f"{parent.path}{self.pk}/" if parent else f"{self.pk}/"
+        if path == previous_path:
+            return
+
+        depth = parent.depth + 1 if parent else 0
+        now = timezone.now()
+        Category.objects.filter(pk=self.pk).update(path=path, depth=depth, updated_at=now)
+        if previous_path:
+            # Move the whole subtree with one UPDATE
+            descendants = Category.objects.filter(path__startswith=previous_path).exclude(
+                pk=self.pk
+            )
+            moved = list(descendants.values_list("pk", flat=True))
+            descendants.update(
+                path=Concat(Value(path), Substr("path", len(previous_path) + 1)),
+                depth=F("depth") + (depth - self.depth),
+                updated_at=now,
+            )
+            # queryset.update() doesn't send signals
+            transaction.on_commit(partial(invalidate_cached_objects, Category, moved))
+        self.path, self.depth = path, depth
+
     class Meta:
         verbose_name = "Category"
         verbose_name_plural = "Categories"
+        indexes = [
+            # Prefix (LIKE 'path%') lookups of subtrees
+            models.Index(
+                fields=["path"], name="core_category_path_idx", opclasses=["varchar_pattern_ops"]
+            ),
+        ]
 
 
 class Product(TimeStampedModel):
@@ -29,20 +84,77 @@ class Product(TimeStampedModel):
     category = models.ForeignKey(
         Category, on_delete=models.CASCADE, verbose_name="Product category"
     )
+    # Denormalized review aggregates, see Product.apply_rating_change
+    rating_sum = models.PositiveIntegerField(default=0, verbose_name="Sum of ratings")
+    rating_count = models.PositiveIntegerField(default=0, verbose_name="Number of ratings")
+    rating_avg = models.DecimalField(
+        max_digits=3, decimal_places=2, default=0, verbose_name="Average rating"
+    )
+    # Weighted name and description, maintained by a database trigger (see migration 0008)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def apply_rating_change(cls, product_id, rating_delta, count_delta):
+        """
+        Atomically apply added, changed or removed reviews to the rating aggregates
+        of a product with a single UPDATE.
+
+        Review signals call it on save and delete, bulk_create(), queryset.update() and
+        queryset.delete() of reviews must call it explicitly or run reconcile_product_ratings.
+        """
+        rating_sum = F("rating_sum") + rating_delta
+        rating_count = F("rating_count") + count_delta
+        cls.objects.filter(pk=product_id).update(
+            rating_sum=rating_sum,
+            rating_count=rating_count,
+            # Column references in SET are the old values, so the average is computed
+            # from the same expressions as the new sum and count
+            rating_avg=Case(
+                When(rating_count=-count_delta, then=Value(Decimal(0))),
+                default=ExpressionWrapper(
+                    Cast(rating_sum, DecimalField(max_digits=12, decimal_places=2))
+                    / rating_count,
+                    output_field=DecimalField(max_digits=3, decimal_places=2),
+                ),
+            ),
+            updated_at=timezone.now(),
+        )
+        # queryset.update() doesn't send signals, so invalidate cached pages explicitly
+        transaction.on_commit(partial(bump_generation, cls))
+        transaction.on_commit(partial(invalidate_cached_objects, cls, [product_id]))
+
     class Meta:
         verbose_name = "Product"
         verbose_name_plural = "Products"
+        indexes = [
+            # Keyset pagination order
+            models.Index(fields=["created_at", "id"]),
+            # Sorting and filtering of product listings
+            models.Index(fields=["price", "id"]),
+            models.Index(fields=["rating_avg", "id"]),
+            models.Index(fields=["category", "created_at", "id"]),
+            models.Index(fields=["category", "price", "id"]),
+            models.Index(
+                fields=["created_at", "id"],
+                condition=models.Q(stock_quantity__gt=0),
+                name="core_product_in_stock_idx",
+            ),
+            # Full-text search
+            GinIndex(fields=["search_vector"]),
+        ]
 
 
 class Review(TimeStampedModel):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reviews")
     user = models.ForeignKey("auth.User", on_delete=models.CASCADE, related_name="reviews")
     comment = models.TextField(verbose_name="Review comment")
-    rating = models.PositiveIntegerField(verbose_name="Rating")
+    # rating_avg of products fits averages of 1 to 5
+    rating = models.PositiveIntegerField(
+        validators=[MinValueValidator(1), MaxValueValidator(5)], verbose_name="Rating"
+    )
 
     def __str__(self):
         return f"Review for {self.product.name} by {self.user.username}"
@@ -51,4 +163,14 @@ class Review(TimeStampedModel):
         verbose_name = "Review"
         verbose_name_plural = "Reviews"
         unique_together = ["product", "user"]
-        indexes = [models.Index(fields=["product", "user"])]
+        indexes = [
+            models.Index(fields=["product", "user"]),
+            # Keyset pagination order of product reviews
+            models.Index(fields=["product", "created_at", "id"]),
+        ]
+        constraints = [
+            # Also for bulk_create() and update(), which skip the validators
+            models.CheckConstraint(
+                condition=models.Q(rating__gte=1, rating__lte=5), name="core_review_rating_range"
+            ),
+        ]
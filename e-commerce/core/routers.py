@@ -0,0 +1,159 @@
+import threading
+import time
+from contextvars import ContextVar
+from logging import getLogger
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+logger = getLogger(__name__)
+
+STICKY_KEY_PREFIX = "replica:sticky"
+
+# Routing state of the request being handled, set by ReplicaRoutingMiddleware
+_request_state = ContextVar("replica_routing_state", default=None)
+
+
+class ReplicaRoutingState:
+    def __init__(self, request):
+        self.request = request
+        self.replica_allowed = False
+        self.replica_used = False
+        self._sticky = None
+
+    @property
+    def sticky(self):
+        """
+        Whether the user has written recently and must read their writes from the primary.
+        Resolved lazily, because DRF authenticates the user inside the view.
+        """
+        if self._sticky is None:
+            user = getattr(self.request, "user", None)
+            if user is None or not user.is_authenticated:
+                return False
+            self._sticky = bool(cache.get(get_sticky_key(user.pk)))
+        return self._sticky
+
+
+def get_sticky_key(user_id):
+    return f"{STICKY_KEY_PREFIX}:{user_id}"
+
+
+def mark_sticky(user_id):
+    cache.set(get_sticky_key(user_id), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+def set_routing_state(state):
+    return _request_state.set(state)
+
+
+def get_routing_state():
+    return _request_state.get()
+
+
+def reset_routing_state(token):
+    _request_state.reset(token)
+
+
+def get_cache_timeout(timeout):
+    """
+    Shorten the timeout of cache entries built from replica reads.
+
+    Generations are bumped when the primary commits, so a page read from a replica that
+    hasn't replayed the change yet would otherwise stay cached under the new generation.
+    """
+    state = get_routing_state()
+    if state is not None and state.replica_used:
+        return min(timeout, settings.REPLICA_CACHE_TIMEOUT)
+    return timeout
+
+
+class ReplicaLagMonitor:
+    """
+    Per-process cache of the replica lag, the replica is queried at most once per interval.
+    An unreachable replica counts as lagging.
+    """
+
+    query = """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._lag = 0.0
+
+    def _is_stale(self, now):
+        return (
+            self._checked_at is None
+            or now - self._checked_at >= settings.REPLICA_LAG_CHECK_INTERVAL
+        )
+
+    def get_lag(self, alias):
+        now = time.monotonic()
+        if not self._is_stale(now):
+            return self._lag
+
+        with self._lock:
+            if self._is_stale(now):
+                try:
+                    with connections[alias].cursor() as cursor:
+                        cursor.execute(self.query)
+                        self._lag = float(cursor.fetchone()[0])
+                except DatabaseError:
+                    logger.exception("Replica lag check failed")
+                    self._lag = float("inf")
+                self._checked_at = now
+        return self._lag
+
+    def is_lagging(self, alias):
+        return self.get_lag(alias) > settings.REPLICA_MAX_LAG_SECONDS
+
+
+replica_lag_monitor = ReplicaLagMonitor()
+
+
+class ReplicaRouter:
+    """
+    Sends reads of catalog views (views with `replica_reads = True`) to the replica.
+
+    Everything else goes to the primary: writes, reads in other views, reads inside
+    transactions, reads of users who have written in the last REPLICA_STICKY_SECONDS
+    and all reads while the replica lags more than REPLICA_MAX_LAG_SECONDS.
+    """
+
+    replica_alias = "replica"
+    replica_app_labels = {"core"}
+
+    def db_for_read(self, model, **hints):
+        if not settings.REPLICA_READS_ENABLED:
+            return None
+        if model._meta.app_label not in self.replica_app_labels:
+            return None
+
+        state = get_routing_state()
+        if state is None or not state.replica_allowed:
+            return None
+        if connections["default"].in_atomic_block:
+            return None
+        if state.sticky or replica_lag_monitor.is_lagging(self.replica_alias):
+            return None
+        state.replica_used = True
+        return self.replica_alias
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica has the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == self.replica_alias:
+            return False
+        return None
@@ -0,0 +1,145 @@
+import decimal
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import fields, relations
+from rest_framework.settings import ISO_8601, api_settings
+
+
+def _compile_decimal(field):
+    coerce_to_string = getattr(field, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.localize or field.normalize_output or not coerce_to_string:
+        return field.to_representation
+    if field.decimal_places is None:
+        return "{:f}".format
+
+    exponent = decimal.Decimal(".1") ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        return "{:f}".format(value.quantize(exponent, rounding=rounding, context=context))
+
+    return convert
+
+
+def _compile_datetime(field):
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+    field_timezone = field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    if field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith("+00:00"):
+            return value[:-6] + "Z"
+        return value
+
+    return convert
+
+
+# Fields whose database values are already their representation
+_IDENTITY_FIELDS = (
+    fields.BooleanField,
+    fields.CharField,
+    fields.IntegerField,
+)
+
+# Fields that need related objects or the instance
+_UNSUPPORTED_FIELDS = (
+    relations.RelatedField,
+    relations.ManyRelatedField,
+    fields.SerializerMethodField,
+    fields.HiddenField,
+)
+
+
+def _needs_instance(field):
+    if "." in field.source or field.source == "*":
+        return True
+    return isinstance(field, _UNSUPPORTED_FIELDS) and not isinstance(
+        field, relations.PrimaryKeyRelatedField
+    )
+
+
+def _compile_field(field):
+    """
+    Returns a converter of database values to the representation of the field,
+    or None when the value can be used as is.
+    """
+    if _needs_instance(field):
+        raise ImproperlyConfigured(
+            f"{type(field).__name__} {field.field_name!r} needs the instance or related objects"
+        )
+    if isinstance(field, fields.DecimalField):
+        return _compile_decimal(field)
+    if isinstance(field, fields.DateTimeField):
+        return _compile_datetime(field)
+    if isinstance(field, relations.PrimaryKeyRelatedField):
+        return None if field.pk_field is None else field.pk_field.to_representation
+    if isinstance(field, _IDENTITY_FIELDS):
+        return None
+    return field.to_representation
+
+
+class ValuesSerializer:
+    """
+    Read-only fast path of a ModelSerializer for list pages.
+
+    Rows are fetched with values() and converted with converters compiled once per
+    serializer class, no model instances or bound fields are built per row.
+    The output is the same as ModelSerializer(many=True).data, so the schema of the
+    ModelSerializer stays the documented one. Only flat fields of the model are supported.
+    """
+
+    _cache = {}
+
+    def __init__(self, serializer_class):
+        serializer_fields = [
+            field for field in serializer_class().fields.values() if not field.write_only
+        ]
+        self.sources = [field.source for field in serializer_fields]
+        self.converters = [
+            (field.source, converter)
+            for field in serializer_fields
+            if (converter := _compile_field(field)) is not None
+        ]
+        # values() returns keys in the order of the sources, which is the order of the fields
+        self.renames = [
+            (field.source, field.field_name)
+            for field in serializer_fields
+            if field.source != field.field_name
+        ]
+
+    @classmethod
+    def for_serializer(cls, serializer_class):
+        # Converters depend on settings, but not on the request
+        serializer = cls._cache.get(serializer_class)
+        if serializer is None:
+            serializer = cls._cache[serializer_class] = cls(serializer_class)
+        return serializer
+
+    def values(self, queryset):
+        """
+        Dicts of the serialized fields, usable by the paginators in place of instances.
+        """
+        return queryset.values(*self.sources)
+
+    def to_representation(self, rows):
+        converters = self.converters
+        data = []
+        for row in rows:
+            # Cached pages can be shared, so rows are not changed in place
+            item = row.copy()
+            for source, converter in converters:
+                value = item[source]
+                if value is not None:
+                    item[source] = converter(value)
+            data.append(item)
+        if self.renames:
+            names = dict(self.renames)
+            data = [{names.get(key, key): value for key, value in item.items()} for item in data]
+        return data
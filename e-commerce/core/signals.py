@@ -0,0 +1,66 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+
+from .cache import bump_generation, invalidate_cached_objects
+from .models.products import Category, Product, Review
+
+CACHED_MODELS = (Category, Product, Review)
+
+
+def invalidate_model_cache(sender, instance, **kwargs):
+    # Bump only after commit, otherwise a concurrent reader can cache
+    # the old rows under the new generation.
+    transaction.on_commit(partial(bump_generation, sender))
+    transaction.on_commit(partial(invalidate_cached_objects, sender, [instance.pk]))
+
+
+for model in CACHED_MODELS:
+    post_save.connect(
+        invalidate_model_cache, sender=model, dispatch_uid=f"cache:{model._meta.label_lower}:save"
+    )
+    post_delete.connect(
+        invalidate_model_cache,
+        sender=model,
+        dispatch_uid=f"cache:{model._meta.label_lower}:delete",
+    )
+
+
+def remember_review_rating(sender, instance, **kwargs):
+    # Deltas of a save are computed from the state the review was loaded with
+    instance._rating_state = (
+        (instance.__dict__.get("product_id"), instance.__dict__.get("rating"))
+        if instance.pk
+        else None
+    )
+
+
+def apply_review_rating(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous_product_id, previous_rating = instance._rating_state or (None, None)
+    if created:
+        Product.apply_rating_change(instance.product_id, instance.rating, 1)
+    elif previous_rating is None:
+        # Loaded without the rating, e.g. with only(), left to reconcile_product_ratings
+        pass
+    elif instance.product_id != previous_product_id:
+        Product.apply_rating_change(previous_product_id, -previous_rating, -1)
+        Product.apply_rating_change(instance.product_id, instance.rating, 1)
+    elif instance.rating != previous_rating:
+        Product.apply_rating_change(instance.product_id, instance.rating - previous_rating, 0)
+    instance._rating_state = (instance.product_id, instance.rating)
+
+
+def revert_review_rating(sender, instance, **kwargs):
+    # Also runs for reviews deleted by the cascade of a user or product
+    product_id, rating = instance._rating_state or (None, None)
+    if rating is None:
+        product_id, rating = instance.product_id, instance.rating
+    Product.apply_rating_change(product_id, -rating, -1)
+
+
+post_init.connect(remember_review_rating, sender=Review, dispatch_uid="rating:review:init")
+post_save.connect(apply_review_rating, sender=Review, dispatch_uid="rating:review:save")
+post_delete.connect(revert_review_rating, sender=Review, dispatch_uid="rating:review:delete")
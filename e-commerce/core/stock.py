@@ -0,0 +1,123 @@
+from collections import Counter
+from functools import partial, reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+from django.utils import timezone
+
+from .cache import bump_generation, invalidate_cached_objects
+from .models.products import Product
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f"Insufficient stock for products {product_ids}")
+        self.product_ids = product_ids
+
+
+def _lock_stock(product_ids):
+    """
+    Lock product rows and return their stock quantities.
+
+    Rows are always locked in primary key order, so concurrent checkouts
+    of overlapping carts acquire locks in the same order and can't deadlock.
+    """
+    return dict(
+        Product.objects.select_for_update()
+        .filter(pk__in=product_ids)
+        .order_by("pk")
+        .values_list("pk", "stock_quantity")
+    )
+
+
+def _apply_stock_changes(changes, stock, condition=None):
+    """
+    Apply {product_id: delta} to stock quantities with a single UPDATE, `stock` holds
+    the locked quantities before the change. Returns the number of updated rows.
+    """
+    updated = (
+        Product.objects.filter(condition or Q(pk__in=changes))
+        .update(
+            stock_quantity=Case(
+                *(
+                    When(pk=product_id, then=F("stock_quantity") + delta)
+                    for product_id, delta in changes.items()
+                ),
+                default=F("stock_quantity"),
+                output_field=PositiveIntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+    )
+    # queryset.update() doesn't send signals, so invalidate the cached products explicitly.
+    # List and search pages are only dropped when a product runs out of stock or comes back,
+    # which changes the in_stock filter, not on every checkout.
+    transaction.on_commit(partial(invalidate_cached_objects, Product, list(changes)))
+    if any(
+        (stock[product_id] == 0) != (stock[product_id] + delta == 0)
+        for product_id, delta in changes.items()
+    ):
+        transaction.on_commit(partial(bump_generation, Product))
+    return updated
+
+
+@transaction.atomic
+def reserve_stock(quantities):
+    """
+    Take {product_id: quantity} from stock, all or nothing.
+
+    Raises InsufficientStock with the products that don't have enough stock.
+    The decrement is conditional (stock_quantity >= quantity), so the stock
+    can't go below zero even if the rows were not locked by the caller.
+    """
+    quantities = {
+        product_id: quantity for product_id, quantity in quantities.items() if quantity > 0
+    }
+    if not quantities:
+        return
+
+    stock = _lock_stock(quantities)
+    missing = [
+        product_id
+        for product_id, quantity in sorted(quantities.items())
+        if stock.get(product_id, 0) < quantity
+    ]
+    if missing:
+        raise InsufficientStock(missing)
+
+    condition = reduce(
+        or_,
+        (
+            Q(pk=product_id, stock_quantity__gte=quantity)
+            for product_id, quantity in quantities.items()
+        ),
+    )
+    changes = {product_id: -quantity for product_id, quantity in quantities.items()}
+    if _apply_stock_changes(changes, stock, condition) != len(quantities):
+        raise InsufficientStock(sorted(quantities))
+
+
+@transaction.atomic
+def release_stock(quantities):
+    """
+    Return {product_id: quantity} to stock, e.g. when an order is canceled.
+    """
+    quantities = {
+        product_id: quantity for product_id, quantity in quantities.items() if quantity > 0
+    }
+    if not quantities:
+        return
+
+    stock = _lock_stock(quantities)
+    _apply_stock_changes(quantities, stock)
+
+
+def get_order_quantities(items):
+    """
+    Sum quantities of order or cart items by product.
+    """
+    quantities = Counter()
+    for item in items:
+        quantities[item.product_id] += item.quantity
+    return dict(quantities)
@@ -3,6 +3,7 @@ from logging import getLogger
 
 from celery import shared_task
 from core.models.orders import Order
+from core.warmup import warm_cache
 
 logger = getLogger(__name__)
 
@@ -21,3 +22,12 @@ def send_order_changed_notification(order_id: int, message="Order status changed
     time.sleep(4)
 
     logger.info(f"Notification sent for order {order_id}")
+
+
+@shared_task
+def warm_cache_task(limit=200, pages=5, products=50, concurrency=4, budget=60):
+    """
+    Refill the caches after a deploy or a Redis flush, see the warm_cache command.
+    """
+    warmed, skipped = warm_cache(limit, pages, products, concurrency, budget)
+    logger.info(f"Cache warm-up: {warmed} URLs warmed, {skipped} skipped by the time budget")
@@ -0,0 +1,175 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cache as memoize
+from logging import getLogger
+
+import redis
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+logger = getLogger(__name__)
+
+THROTTLE_KEY_PREFIX = "throttle"
+
+# Refills the bucket for the time since the last request and takes a token, atomically and in
+# one round trip. The clock of Redis is shared by all app servers.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """
+    The state of a bucket after a request, for the RateLimit-* response headers.
+    """
+
+    limit: int
+    period: int
+    tokens: float
+    rate: float
+
+    @property
+    def remaining(self):
+        return math.floor(self.tokens)
+
+    @property
+    def wait(self):
+        # Seconds until the next token
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    @property
+    def reset(self):
+        # Seconds until the bucket is full again
+        return math.ceil((self.limit - self.tokens) / self.rate)
+
+
+class LocalTokenBuckets:
+    """
+    Token buckets of one process, used while Redis is unreachable.
+    The least recently used buckets are dropped above THROTTLE_LOCAL_MAX_BUCKETS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > settings.THROTTLE_LOCAL_MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+local_buckets = LocalTokenBuckets()
+
+
+@memoize
+def get_throttle_redis():
+    # Short timeouts, a slow Redis must not hold up every request
+    return redis.Redis.from_url(
+        settings.CACHES["default"]["LOCATION"],
+        socket_timeout=settings.THROTTLE_REDIS_TIMEOUT,
+        socket_connect_timeout=settings.THROTTLE_REDIS_TIMEOUT,
+    )
+
+
+@memoize
+def get_token_bucket_script():
+    # EVALSHA, with EVAL when the script isn't loaded yet
+    return get_throttle_redis().register_script(TOKEN_BUCKET_SCRIPT)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket per client and scope, kept in Redis so the budget is shared by all app servers.
+
+    Authenticated clients are identified by user, others by IP, with separate rates for safe
+    and unsafe methods. Views with `throttle_scope = "auth"` are limited per IP in every case.
+    Rates are the `user.read`, `user.write`, `anon.read`, `anon.write` and `auth` entries of
+    DEFAULT_THROTTLE_RATES, e.g. "60/min" is a bucket of 60 tokens refilled at one per second.
+
+    When Redis is unreachable, buckets of the process are used for THROTTLE_REDIS_RETRY_INTERVAL
+    seconds, so the limits are per worker until Redis is back. The in-process requests of the
+    cache warm-up aren't throttled.
+    """
+
+    _redis_down_until = 0.0
+
+    def __init__(self):
+        # Like ScopedRateThrottle, the rate depends on the request
+        pass
+
+    def get_scope(self, request, view):
+        scope = getattr(view, "throttle_scope", None)
+        if scope is not None:
+            return scope
+        kind = "read" if request.method in SAFE_METHODS else "write"
+        return f"user.{kind}" if request.user.is_authenticated else f"anon.{kind}"
+
+    def get_cache_key(self, request, view):
+        if self.scope.startswith("user."):
+            return f"{THROTTLE_KEY_PREFIX}:{self.scope}:{request.user.pk}"
+        return f"{THROTTLE_KEY_PREFIX}:{self.scope}:{self.get_ident(request)}"
+
+    def allow_request(self, request, view):
+        # Warm-up requests aren't traffic, and all come from the same address
+        if getattr(request._request, "cache_warmup", False):
+            return True
+        self.scope = self.get_scope(request, view)
+        # Read per request, SimpleRateThrottle.THROTTLE_RATES is read once at import
+        self.rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if self.rate is None:
+            return True
+        limit, period = self.parse_rate(self.rate)
+        refill_rate = limit / period
+        allowed, tokens = self.take(self.get_cache_key(request, view), limit, refill_rate)
+
+        self.rate_limit = RateLimit(limit, period, tokens, refill_rate)
+        # For RateLimitHeadersMiddleware, the most restrictive throttle wins
+        current = getattr(request._request, "rate_limit", None)
+        if current is None or self.rate_limit.remaining < current.remaining:
+            request._request.rate_limit = self.rate_limit
+        return allowed
+
+    def take(self, key, capacity, rate):
+        if time.monotonic() >= TokenBucketThrottle._redis_down_until:
+            try:
+                allowed, tokens = get_token_bucket_script()(keys=[key], args=[capacity, rate])
+                return bool(allowed), float(tokens)
+            except redis.RedisError:
+                logger.exception("Throttling with local buckets, Redis is unreachable")
+                TokenBucketThrottle._redis_down_until = (
+                    time.monotonic() + settings.THROTTLE_REDIS_RETRY_INTERVAL
+                )
+        return local_buckets.take(key, capacity, rate)
+
+    def wait(self):
+        return self.rate_limit.wait
@@ -1,20 +1,31 @@
 from django.urls import path
 
+from .views.catalog_async import (
+    AsyncCategoryDetailView,
+    AsyncCategoryListView,
+    AsyncProductDetailView,
+    AsyncProductListView,
+    AsyncProductReviewListView,
+)
 from .views.orders import OrderViewSet
 from .views.products import (
     CategoryDetailView,
     CategoryListView,
+    CategoryTreeView,
     ProductDetailView,
     ProductListView,
     ProductReviewListView,
+    ProductSearchView,
     ReviewViewSet,
 )
 from .views.shopping import ShoppingCartViewSet, WishlistViewSet
 
 urlpatterns = [
     path("categories/", CategoryListView.as_view(), name="category-list"),
+    path("categories/tree/", CategoryTreeView.as_view(), name="category-tree"),
     path("categories/<int:pk>/", CategoryDetailView.as_view(), name="category-detail"),
     path("products/", ProductListView.as_view(), name="product-list"),
+    path("products/search/", ProductSearchView.as_view(), name="product-search"),
     path("products/<int:pk>/", ProductDetailView.as_view(), name="product-detail"),
     path("products/<int:pk>/reviews/", ProductReviewListView.as_view(), name="product-reviews"),
     path(
@@ -56,4 +67,20 @@ urlpatterns = [
         OrderViewSet.as_view({"get": "get_detail", "post": "change_status"}),
         name="order-detail",
     ),
+    # Read-only catalog for the ASGI server, same responses as the sync views
+    path("async/categories/", AsyncCategoryListView.as_view(), name="async-category-list"),
+    path(
+        "async/categories/<int:pk>/",
+        AsyncCategoryDetailView.as_view(),
+        name="async-category-detail",
+    ),
+    path("async/products/", AsyncProductListView.as_view(), name="async-product-list"),
+    path(
+        "async/products/<int:pk>/", AsyncProductDetailView.as_view(), name="async-product-detail"
+    ),
+    path(
+        "async/products/<int:pk>/reviews/",
+        AsyncProductReviewListView.as_view(),
+        name="async-product-reviews",
+    ),
 ]
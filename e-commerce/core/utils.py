@@ -1,9 +1,25 @@
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import reduce
+from operator import or_
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.cache import cache
-from django.core.paginator import InvalidPage, Page, PageNotAnInteger, Paginator
-from django.db import models
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, InvalidPage, Page, PageNotAnInteger, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models
 from django.utils.functional import cached_property
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .cache import canonical_query_hash, get_generations, get_or_set_stale
+from .routers import get_cache_timeout
+from .serializers import ValuesSerializer
 
 
 class TimeStampedModel(models.Model):
@@ -14,9 +30,65 @@ class TimeStampedModel(models.Model):
         abstract = True
 
 
+def estimate_count(queryset):
+    """
+    Estimate the number of rows in a queryset from PostgreSQL statistics.
+
+    Unfiltered querysets read pg_class.reltuples, filtered ones take the row estimate
+    of the planner. Returns None when there is no estimate (other database vendors
+    or a table that was never analyzed).
+    """
+    query = queryset.query
+    # none() querysets can't be compiled to SQL
+    if query.is_empty():
+        return 0
+
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+
+    with connection.cursor() as cursor:
+        if not query.where and not query.distinct and not query.is_sliced:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            # reltuples is -1 for tables that were never vacuumed or analyzed
+            return row[0] if row and row[0] >= 0 else None
+
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]["Plan Rows"]
+
+
+def _get_view_generations(queryset, view=None):
+    return get_generations(queryset.model, *getattr(view, "cache_dependencies", ()))
+
+
+class ValuesListMixin:
+    """
+    List views that page values() rows and serialize them with ValuesSerializer
+    instead of building model instances. The serializer class still documents the response.
+    """
+
+    def list(self, request, *args, **kwargs):
+        serializer = ValuesSerializer.for_serializer(self.get_serializer_class())
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(serializer.to_representation(queryset))
+        return self.get_paginated_response(serializer.to_representation(page))
+
+
 class CachedLimitOffsetPagination(LimitOffsetPagination):
-    cache_key = "cached_paginator"  # Base cache key
-    cache_timeout = 300  # Cache timeout in seconds
+    # Versioned, pages hold values() rows and are stored with their freshness deadline
+    cache_key = "cached_paginator:v3"  # Base cache key
+    # Pages are invalidated by model generations, so the timeout only bounds memory usage
+    cache_timeout = 60 * 60 * 24  # Cache timeout in seconds
 
     def paginate_queryset(self, queryset, request, view=None):
         """
@@ -32,8 +104,9 @@ class CachedLimitOffsetPagination(LimitOffsetPagination):
         paginator = CachedPaginator(
             queryset,
             self.limit,
-            cache_key=self._generate_cache_key(request),
+            cache_key=self._generate_cache_key(request, queryset, view),
             cache_timeout=self.cache_timeout,
+            estimate_count_threshold=settings.PAGINATOR_ESTIMATED_COUNT_THRESHOLD,
         )
 
         # Calculate the page number based on the offset
@@ -42,15 +115,27 @@ class CachedLimitOffsetPagination(LimitOffsetPagination):
         try:
             self.page = paginator.page(page_number)
         except InvalidPage as exc:
-            self.page = None
-            self._handle_invalid_page(exc)
+            raise NotFound(str(exc))
 
         # Set the total count required by LimitOffsetPagination
         self.count = paginator.count
+        self.count_is_estimated = paginator.count_is_estimated
         self.request = request
 
         return list(self.page)
 
+    def get_next_link(self):
+        if not self.count_is_estimated:
+            return super().get_next_link()
+
+        # The estimate can be lower than the real count,
+        # so the next page exists as long as the current one is full.
+        if len(self.page) < self.limit:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
     def get_paginated_response(self, data):
         """
         Return a formatted paginated response.
@@ -58,17 +143,37 @@ class CachedLimitOffsetPagination(LimitOffsetPagination):
         return Response(
             {
                 "count": self.count,
+                "count_is_estimated": self.count_is_estimated,
                 "next": self.get_next_link(),
                 "previous": self.get_previous_link(),
                 "results": data,
             }
         )
 
-    def _generate_cache_key(self, request):
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"]["count_is_estimated"] = {
+            "type": "boolean",
+            "description": "The count is an estimate from table statistics, "
+            "the next link is set as long as the page is full",
+            "example": False,
+        }
+        return response_schema
+
+    def _generate_cache_key(self, request, queryset, view=None):
         """
-        Generate a unique cache key based on the request path, limit, and offset.
+        Generate a unique cache key based on the request path, query string, limit, offset
+        and generations of the models the page is built from.
+
+        Views can declare extra models their pages depend on via `cache_dependencies`.
         """
-        return f"{self.cache_key}:{request.path}:{self.limit}:{self.offset}"
+        generations = _get_view_generations(queryset, view)
+        query_hash = canonical_query_hash(
+            request.query_params, exclude=(self.limit_query_param, self.offset_query_param)
+        )
+        return (
+            f"{self.cache_key}:{request.path}:{generations}:{query_hash}:{self.limit}:{self.offset}"
+        )
 
 
 class CachedPaginator(Paginator):
@@ -82,12 +187,16 @@ class CachedPaginator(Paginator):
         allow_empty_first_page=True,
         cache_key=None,
         cache_timeout=300,
+        estimate_count_threshold=None,
     ):
         super(CachedPaginator, self).__init__(
             object_list, per_page, orphans, allow_empty_first_page
         )
         self.cache_key = cache_key
         self.cache_timeout = cache_timeout
+        # Counts at or above the threshold are estimated instead of running COUNT(*)
+        self.estimate_count_threshold = estimate_count_threshold
+        self.count_is_estimated = False
 
     @cached_property
     def count(self):
@@ -97,14 +206,20 @@ class CachedPaginator(Paginator):
         to override it when loading data from cache. (instead of recalculating it).
         So we make it writable via @cached_property.
         """
+        if self.estimate_count_threshold is not None and hasattr(self.object_list, "query"):
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate >= self.estimate_count_threshold:
+                self.count_is_estimated = True
+                return estimate
         return super(CachedPaginator, self).count
 
-    def set_count(self, count):
+    def set_count(self, count, is_estimated=False):
         """
         Override the paginator.count value (to prevent recalculation)
         and clear num_pages and page_range which values depend on it.
         """
         self.count = count
+        self.count_is_estimated = is_estimated
         # if somehow we have stored .num_pages or .page_range (which are cached properties)
         # this can lead to wrong page calculations (because they depend on paginator.count value)
         # so we clear their values to force recalculations on next calls
@@ -117,6 +232,26 @@ class CachedPaginator(Paginator):
         except AttributeError:
             pass
 
+    def validate_number(self, number):
+        # Computing the count decides whether it is estimated
+        self.count
+        if not self.count_is_estimated:
+            return super(CachedPaginator, self).validate_number(number)
+        # The estimate can be lower than the real count,
+        # so pages past the estimated end are not rejected
+        number = int(number)
+        if number < 1:
+            raise EmptyPage("That page number is less than 1")
+        return number
+
+    def _fetch_page(self, number):
+        number = self.validate_number(number)
+        if not self.count_is_estimated:
+            return super(CachedPaginator, self).page(number)
+        # Don't clamp the last page to the estimated count
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom : bottom + self.per_page], number, self)
+
     @cached_property
     def num_pages(self):
         """This is not writable in Django1.8. We want to make it writable"""
@@ -136,7 +271,7 @@ class CachedPaginator(Paginator):
         it will pull a fresh list and then cache that result + the total result count.
         """
         if self.cache_key is None:
-            return super(CachedPaginator, self).page(number)
+            return self._fetch_page(number)
 
         # In order to prevent counting the queryset
         # we only validate that the provided number is integer
@@ -149,16 +284,301 @@ class CachedPaginator(Paginator):
             raise PageNotAnInteger("That page number is not an integer")
 
         page_cache_key = "%s:%s:%s" % (self.cache_key, self.per_page, number)
-        page_data = cache.get(page_cache_key)
+        fetched = []
 
-        if page_data is None:
-            page = super(CachedPaginator, self).page(number)
+        def fetch_page():
+            page = self._fetch_page(number)
+            fetched.append(page)
             # cache not only the objects, but the total count too.
-            page_data = (page.object_list, self.count)
-            cache.set(page_cache_key, page_data, self.cache_timeout)
-        else:
-            cached_object_list, cached_total_count = page_data
-            self.set_count(cached_total_count)
-            page = Page(cached_object_list, number, self)
+            return page.object_list, self.count, self.count_is_estimated
+
+        # A new generation misses every page at once, so only one request builds each page
+        page_data = get_or_set_stale(page_cache_key, fetch_page, self.cache_timeout)
+        if fetched:
+            return fetched[0]
+
+        cached_object_list, cached_total_count, cached_is_estimated = page_data
+        self.set_count(cached_total_count, cached_is_estimated)
+        return Page(cached_object_list, number, self)
 
+
+class _PositionEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder truncates microseconds, positions must be exact
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_position, previous_position):
+        self.object_list = object_list
+        self.next_position = next_position
+        self.previous_position = previous_position
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    A paginator that seeks to the requested page by the values of the ordering fields
+    of the last seen row instead of skipping rows with OFFSET.
+
+    The ordering must end with a unique field (usually "id" or "-id"), so every row
+    has a distinct position. The total count is never computed, so every page costs
+    one indexed range scan no matter how deep it is.
+    Pages are cached the same way as in CachedPaginator.
+    """
+
+    def __init__(self, object_list, per_page, ordering, cache_key=None, cache_timeout=300):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.cache_key = cache_key
+        self.cache_timeout = cache_timeout
+
+    def page(self, position=None, reverse=False):
+        """
+        Returns a KeysetPage with rows that follow the given position
+        (or precede it when reverse is set). No position means the first page.
+        """
+        if self.cache_key is None:
+            return self._fetch_page(position, reverse)
+
+        page_cache_key = "%s:%s:%s" % (
+            self.cache_key,
+            self.per_page,
+            self.encode_position(position, reverse) if position is not None else "",
+        )
+        page = cache.get(page_cache_key)
+        if page is None:
+            page = self._fetch_page(position, reverse)
+            cache.set(page_cache_key, page, get_cache_timeout(self.cache_timeout))
         return page
+
+    def _fetch_page(self, position, reverse):
+        ordering = self._reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = self.object_list.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._seek_filter(ordering, position))
+
+        # Fetch one extra row to know if there is one more page in this direction
+        object_list = list(queryset[: self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[: self.per_page]
+
+        if reverse:
+            object_list.reverse()
+            next_position = self.get_position(object_list[-1]) if object_list else position
+            previous_position = self.get_position(object_list[0]) if has_more else None
+        else:
+            next_position = self.get_position(object_list[-1]) if has_more else None
+            previous_position = (
+                self.get_position(object_list[0]) if position is not None and object_list else None
+            )
+
+        return KeysetPage(object_list, next_position, previous_position)
+
+    @staticmethod
+    def _reverse_ordering(ordering):
+        return tuple(field[1:] if field.startswith("-") else f"-{field}" for field in ordering)
+
+    @staticmethod
+    def _seek_filter(ordering, position):
+        """
+        Build `(a, b, c) > (x, y, z)` as
+        `a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)`,
+        with the comparison flipped for descending fields.
+        """
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            equal = {f.lstrip("-"): value for f, value in zip(ordering[:index], position)}
+            conditions.append(models.Q(**equal, **{f"{name}__{lookup}": position[index]}))
+        return reduce(or_, conditions)
+
+    def _get_field(self, name):
+        try:
+            return self.object_list.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations are not model fields
+            return None
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            name = field.lstrip("-")
+            model_field = self._get_field(name)
+            attname = model_field.attname if model_field is not None else name
+            if isinstance(instance, dict):
+                position.append(instance.get(attname, instance.get(name)))
+            else:
+                position.append(getattr(instance, attname))
+        return tuple(position)
+
+    def encode_position(self, position, reverse=False):
+        data = json.dumps([list(position), int(reverse)], cls=_PositionEncoder)
+        return urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def decode_position(self, encoded):
+        """
+        Returns (position, reverse) decoded from an opaque cursor.
+        Raises ValueError if the cursor is malformed.
+        """
+        try:
+            padded = encoded + "=" * (-len(encoded) % 4)
+            values, reverse = json.loads(urlsafe_b64decode(padded.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError("Cursor does not match the ordering")
+
+            position = []
+            for field, value in zip(self.ordering, values):
+                model_field = self._get_field(field.lstrip("-"))
+                if model_field:
+                    value = model_field.to_python(value)
+                # Positions are compared with < and >, which never match NULL
+                if value is None:
+                    raise ValueError("Cursor has an empty position")
+                position.append(value)
+        except (TypeError, ValidationError, json.JSONDecodeError, UnicodeError) as exc:
+            raise ValueError("Invalid cursor") from exc
+        return tuple(position), bool(reverse)
+
+
+class CachedKeysetPagination(CursorPagination):
+    """
+    Keyset pagination with opaque cursors, backed by KeysetPaginator.
+
+    Views can change the sort with `keyset_ordering`, the last field must be unique.
+    """
+
+    cache_key = "cached_keyset_paginator:v2"
+    cache_timeout = CachedLimitOffsetPagination.cache_timeout
+    ordering = ("-created_at", "-id")
+    page_size_query_param = "limit"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        paginator = KeysetPaginator(
+            queryset,
+            self.page_size,
+            self.get_ordering(request, queryset, view),
+            cache_key=self._generate_cache_key(request, queryset, view),
+            cache_timeout=self.cache_timeout,
+        )
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        position, reverse = None, False
+        if encoded:
+            try:
+                position, reverse = paginator.decode_position(encoded)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+
+        self.paginator = paginator
+        self.page = paginator.page(position, reverse)
+        self.request = request
+        return list(self.page)
+
+    def get_ordering(self, request, queryset, view):
+        """
+        The explicit ordering of the queryset wins over `keyset_ordering` of the view.
+        """
+        if queryset.query.order_by:
+            return queryset.query.order_by
+        return getattr(view, "keyset_ordering", self.ordering)
+
+    def get_next_link(self):
+        if self.page.next_position is None:
+            return None
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            self.paginator.encode_position(self.page.next_position),
+        )
+
+    def get_previous_link(self):
+        if self.page.previous_position is None:
+            return None
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            self.paginator.encode_position(self.page.previous_position, reverse=True),
+        )
+
+    def _generate_cache_key(self, request, queryset, view=None):
+        generations = _get_view_generations(queryset, view)
+        query_hash = canonical_query_hash(request.query_params, exclude=(self.cursor_query_param,))
+        return f"{self.cache_key}:{request.path}:{generations}:{query_hash}"
+
+
+class CachedCatalogPagination(CachedLimitOffsetPagination):
+    """
+    Limit-offset pagination that switches to keyset pagination when the request
+    has a cursor parameter. An empty cursor (`?cursor=`) returns the first page.
+    """
+
+    keyset_pagination_class = CachedKeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["required"] = ["results"]
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                "name": self.keyset_pagination_class.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Keyset pagination cursor, pass an empty value for the first page. "
+                "The count is not returned in this mode.",
+                "schema": {"type": "string"},
+            }
+        ]
+
+
+class AsyncLimitOffsetPagination(CachedLimitOffsetPagination):
+    """
+    Limit-offset pagination for async views, pages are read with the async ORM.
+
+    Responses have the same shape as CachedLimitOffsetPagination, large counts are
+    estimated the same way. Pages are not cached and there is no keyset mode.
+    """
+
+    async def apaginate_queryset(self, queryset, request):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        self.count, self.count_is_estimated = await self.aget_count(queryset)
+        self.page = [obj async for obj in queryset[self.offset : self.offset + self.limit]]
+        return self.page
+
+    @staticmethod
+    async def aget_count(queryset):
+        threshold = settings.PAGINATOR_ESTIMATED_COUNT_THRESHOLD
+        estimate = await sync_to_async(estimate_count)(queryset)
+        if estimate is not None and estimate >= threshold:
+            return estimate, True
+        return await queryset.acount(), False
@@ -0,0 +1,188 @@
+import asyncio
+from weakref import WeakKeyDictionary
+
+from asgiref.sync import sync_to_async
+from core.cache import CachedResponseMixin
+from core.models.products import Category, Product, Review
+from core.serializers import ValuesSerializer
+from core.utils import AsyncLimitOffsetPagination
+from core.views.products import (
+    CategorySerializer,
+    ProductFilterSerializer,
+    ProductListView,
+    ProductSerializer,
+    ReviewSerializer,
+)
+from django.conf import settings
+from django.db import connections
+from django.http import Http404
+from django.shortcuts import aget_object_or_404
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+# Semaphores of the event loops, asyncio primitives can't be shared between loops
+_db_semaphores = WeakKeyDictionary()
+
+
+def close_connections():
+    # Connections inside a transaction belong to the caller, e.g. the test case
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def get_db_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _db_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _db_semaphores[loop] = asyncio.Semaphore(settings.ASYNC_DB_CONCURRENCY)
+    return semaphore
+
+
+class AsyncCatalogView(CachedResponseMixin, View):
+    """
+    Read-only catalog views for the ASGI server.
+
+    Queries go through the async ORM, so a worker serves many slow clients from one
+    event loop. Responses are built with the serializers and JSON renderer of the
+    sync DRF views, so both paths return the same documents.
+
+    Like the sync views, requests are throttled, reads go to the replica and rendered
+    responses are cached and answer conditional requests with their ETag. Pages and objects
+    aren't cached separately, a miss of the response cache queries the database.
+
+    The async ORM runs queries in a thread of the request with its own connection,
+    so at most ASYNC_DB_CONCURRENCY requests of a worker query the database at once
+    and their connections are closed before the response is sent.
+    """
+
+    http_method_names = ["get", "head"]
+    replica_reads = True
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    queryset = None
+    serializer_class = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        # For query_params, absolute pagination links and the user of the throttles
+        self.request = request = Request(
+            request,
+            authenticators=[authentication() for authentication in self.authentication_classes],
+            parser_context={"view": self, "args": args, "kwargs": kwargs},
+        )
+        try:
+            # Buckets are in Redis, read through the sync client like the cache
+            await sync_to_async(self.check_throttles)(request)
+        except APIException as exc:
+            return self.render_exception(exc)
+
+        if not self.response_is_cacheable(request):
+            return await self.aget_response(request, *args, **kwargs)
+
+        # The cache is read through its sync client, like the database
+        cache_key, response = await sync_to_async(self.get_cached_response)(request)
+        if response is None:
+            response = await self.aget_response(request, *args, **kwargs)
+            if not await sync_to_async(self.cache_response)(cache_key, response):
+                return response
+        return self.get_conditional_response(request, response)
+
+    async def aget_response(self, request, *args, **kwargs):
+        async with get_db_semaphore():
+            try:
+                # Skips the sync dispatch() of CachedResponseMixin
+                return await View.dispatch(self, request, *args, **kwargs)
+            except (Http404, APIException) as exc:
+                return self.render_exception(exc)
+            finally:
+                await sync_to_async(close_connections)()
+
+    def check_throttles(self, request):
+        # The throttles of APIView.check_throttles(), the catalog needs no permissions
+        for throttle in [throttle() for throttle in self.throttle_classes]:
+            if not throttle.allow_request(request, self):
+                raise Throttled(throttle.wait())
+
+    def render_exception(self, exc):
+        # The same body and headers, e.g. Retry-After, as the sync views
+        response = exception_handler(exc, {"view": self, "request": self.request})
+        return self.render(response.data, response.status_code, response.headers)
+
+    @staticmethod
+    def render(data, status_code=status.HTTP_200_OK, headers=None):
+        response = Response(data, status=status_code, headers=headers)
+        response.accepted_renderer = JSONRenderer()
+        response.accepted_media_type = JSONRenderer.media_type
+        response.renderer_context = {}
+        return response.render()
+
+    def get_serializer_class(self):
+        return self.serializer_class
+
+    async def aget_queryset(self):
+        return self.queryset.all()
+
+
+class AsyncListView(AsyncCatalogView):
+    pagination_class = AsyncLimitOffsetPagination
+
+    async def get(self, request, *args, **kwargs):
+        serializer = ValuesSerializer.for_serializer(self.serializer_class)
+        paginator = self.pagination_class()
+        queryset = serializer.values(await self.aget_queryset())
+        page = await paginator.apaginate_queryset(queryset, request)
+        data = serializer.to_representation(page)
+        return self.render(paginator.get_paginated_response(data).data)
+
+
+class AsyncDetailView(AsyncCatalogView):
+    def get_response_cache_object_pk(self):
+        return self.kwargs["pk"]
+
+    async def get(self, request, *args, **kwargs):
+        instance = await aget_object_or_404(await self.aget_queryset(), pk=kwargs["pk"])
+        return self.render(self.serializer_class(instance).data)
+
+
+class AsyncCategoryListView(AsyncListView):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+
+
+class AsyncCategoryDetailView(AsyncDetailView):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+
+
+class AsyncProductListView(AsyncListView):
+    queryset = Product.objects.all()
+    serializer_class = ProductSerializer
+
+    async def aget_queryset(self):
+        filters = ProductFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        params = filters.validated_data
+
+        subtree_path = None
+        if params.get("category") is not None and params["descendants"]:
+            category = Category.objects.filter(pk=params["category"])
+            subtree_path = await category.values_list("path", flat=True).afirst()
+        return ProductListView.filter_products(self.queryset.all(), params, subtree_path)
+
+
+class AsyncProductDetailView(AsyncDetailView):
+    queryset = Product.objects.all()
+    serializer_class = ProductSerializer
+
+
+class AsyncProductReviewListView(AsyncListView):
+    serializer_class = ReviewSerializer
+
+    async def aget_queryset(self):
+        return Review.objects.filter(product_id=self.kwargs["pk"])
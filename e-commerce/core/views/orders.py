@@ -1,14 +1,17 @@
+from core.cache import ConditionalGetMixin
 from core.models.orders import Order, OrderItem, Payment
+from core.stock import InsufficientStock, get_order_quantities, release_stock, reserve_stock
 from core.tasks import send_order_changed_notification
+from django.db import transaction
 from drf_spectacular.utils import extend_schema
-from rest_framework import serializers, viewsets
+from rest_framework import serializers, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 
 @extend_schema(tags=["orders"])
-class OrderViewSet(viewsets.GenericViewSet):
+class OrderViewSet(ConditionalGetMixin, viewsets.GenericViewSet):
     class OrderSerializer(serializers.ModelSerializer):
         class PaymentSerializer(serializers.ModelSerializer):
             class Meta:
@@ -35,9 +38,12 @@ class OrderViewSet(viewsets.GenericViewSet):
     serializer_class = OrderSerializer
     permission_classes = (IsAuthenticated,)
     lookup_field = "pk"
+    admission_priority = "high"
+    # Nested in the order representation
+    validator_relations = ("items", "payments")
 
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user)
+        return self.queryset.filter(user_id=self.request.user.id)
 
     @extend_schema(summary="Get order detail")
     @action(methods=["GET"], detail=False)
@@ -53,10 +59,28 @@ class OrderViewSet(viewsets.GenericViewSet):
 
     @extend_schema(summary="Change order status")
     @action(methods=["POST"], detail=False)
+    @transaction.atomic
     def change_status(self, request, pk):
         order = self.get_object()
+        # Lock the order, so concurrent cancellations can't release the stock twice
+        previous_status = (
+            Order.objects.select_for_update().values_list("status", flat=True).get(pk=order.pk)
+        )
         order.status = request.data["status"]
         order.save()
 
+        quantities = get_order_quantities(order.items.all())
+        if order.status == Order.Status.CANCELED and previous_status != Order.Status.CANCELED:
+            release_stock(quantities)
+        elif previous_status == Order.Status.CANCELED and order.status != Order.Status.CANCELED:
+            try:
+                reserve_stock(quantities)
+            except InsufficientStock as exc:
+                transaction.set_rollback(True)
+                return Response(
+                    data={"detail": "Insufficient stock", "product_ids": exc.product_ids},
+                    status=status.HTTP_409_CONFLICT,
+                )
+
         send_order_changed_notification.delay(order.id, f"Order status changed to {order.status}")
         return Response(self.serializer_class(order).data)
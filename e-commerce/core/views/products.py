@@ -1,11 +1,27 @@
+import re
+
+from core.cache import (
+    CachedObjectMixin,
+    CachedResponseMixin,
+    ConditionalGetMixin,
+    get_local_generations,
+    two_tier_cache,
+)
+from core.hits import record_hit
 from core.models.products import Category, Product, Review
-from core.utils import CachedLimitOffsetPagination
+from core.routers import get_cache_timeout
+from core.utils import CachedCatalogPagination, CachedKeysetPagination, ValuesListMixin
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Value
+from django.db.models.functions import Cast
 from drf_spectacular.views import extend_schema
 from rest_framework import serializers, status
 from rest_framework.decorators import action
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
 
@@ -18,7 +34,8 @@ class CategorySerializer(serializers.ModelSerializer):
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ["search_vector"]
+        read_only_fields = ["rating_sum", "rating_count", "rating_avg"]
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -28,70 +45,275 @@ class ReviewSerializer(serializers.ModelSerializer):
         read_only_fields = ["user"]
 
 
+class CategoryTreeSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    product_count = serializers.IntegerField(help_text="Products directly in the category")
+    total_product_count = serializers.IntegerField(
+        help_text="Products in the category and all its subcategories"
+    )
+
+    def get_fields(self):
+        # The class can't refer to itself in its body
+        fields = super().get_fields()
+        fields["subcategories"] = CategoryTreeSerializer(many=True)
+        return fields
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=255, help_text="Search text, the last word is a prefix")
+
+
+class ProductFilterSerializer(serializers.Serializer):
+    # Only sorts backed by an index are allowed, every one ends with the id to be stable
+    ORDERINGS = {
+        "newest": ("-created_at", "-id"),
+        "price": ("price", "id"),
+        "-price": ("-price", "-id"),
+        "rating": ("-rating_avg", "-id"),
+    }
+
+    category = serializers.IntegerField(required=False)
+    descendants = serializers.BooleanField(
+        required=False, default=False, help_text="Include products of all subcategories"
+    )
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    in_stock = serializers.BooleanField(required=False, allow_null=True, default=None)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    ordering = serializers.ChoiceField(choices=list(ORDERINGS), default="newest")
+
+
 @extend_schema(tags=["products"], summary="List of categories")
-class CategoryListView(ListAPIView):
+class CategoryListView(CachedResponseMixin, ConditionalGetMixin, ValuesListMixin, ListAPIView):
+    replica_reads = True
+    public_cache = True
+    response_cache_local = True
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
-    pagination_class = CachedLimitOffsetPagination
+    pagination_class = CachedCatalogPagination
 
 
 @extend_schema(tags=["products"], summary="Category details")
-class CategoryDetailView(RetrieveAPIView):
+class CategoryDetailView(
+    CachedResponseMixin, CachedObjectMixin, ConditionalGetMixin, RetrieveAPIView
+):
+    replica_reads = True
+    public_cache = True
+    response_cache_local = True
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
 
-@extend_schema(tags=["products"], summary="List of products")
-class ProductListView(ListAPIView):
+@extend_schema(
+    tags=["products"], summary="Category tree", responses=CategoryTreeSerializer(many=True)
+)
+class CategoryTreeView(APIView):
+    replica_reads = True
+    cache_key = "category_tree"
+    cache_timeout = 60 * 60 * 24
+
+    def get(self, request):
+        record_hit(request)
+        # Invalidated by generations, as the paginated pages
+        cache_key = f"{self.cache_key}:{get_local_generations(Category, Product)}"
+        tree = two_tier_cache.get(cache_key)
+        if tree is None:
+            tree = self.build_tree()
+            two_tier_cache.set(cache_key, tree, get_cache_timeout(self.cache_timeout))
+        return Response(tree)
+
+    @staticmethod
+    def build_tree():
+        """
+        Build the whole tree with product counts from a single query.
+        """
+        categories = (
+            Category.objects.annotate(product_count=Count("product"))
+            .order_by("name")
+            .values("id", "name", "parent_category_id", "depth", "product_count")
+        )
+        nodes = {}
+        for category in categories:
+            nodes[category["id"]] = {
+                "id": category["id"],
+                "name": category["name"],
+                "product_count": category["product_count"],
+                "total_product_count": category["product_count"],
+                "subcategories": [],
+                "parent_id": category["parent_category_id"],
+                "depth": category["depth"],
+            }
+
+        roots = []
+        # Deepest categories first, so subtree totals are complete before they are added up.
+        # The sort is stable, so siblings stay ordered by name.
+        for node in sorted(nodes.values(), key=lambda node: node["depth"], reverse=True):
+            parent = nodes.get(node.pop("parent_id"))
+            node.pop("depth")
+            if parent is None:
+                roots.append(node)
+            else:
+                parent["total_product_count"] += node["total_product_count"]
+                parent["subcategories"].append(node)
+        return roots
+
+
+@extend_schema(tags=["products"], summary="List of products", parameters=[ProductFilterSerializer])
+class ProductListView(CachedResponseMixin, ConditionalGetMixin, ValuesListMixin, ListAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    pagination_class = CachedLimitOffsetPagination
+    pagination_class = CachedCatalogPagination
+    replica_reads = True
+    public_cache = True
+    validators_from_body = True
+    # Subtree filters depend on category paths
+    cache_dependencies = (Category,)
+
+    def get_queryset(self):
+        """
+        Filters are part of the query string, so they are part of the paginator cache key.
+        """
+        filters = ProductFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        params = filters.validated_data
+
+        subtree_path = None
+        if params.get("category") is not None and params["descendants"]:
+            category = Category.objects.filter(pk=params["category"])
+            subtree_path = category.values_list("path", flat=True).first()
+        return self.filter_products(super().get_queryset(), params, subtree_path)
+
+    @staticmethod
+    def filter_products(queryset, params, subtree_path=None):
+        """
+        Apply validated ProductFilterSerializer params.
+        `subtree_path` is the path of the `category` filter, needed when `descendants` is set.
+        """
+        ordering = ProductFilterSerializer.ORDERINGS[params["ordering"]]
+        queryset = queryset.order_by(*ordering)
+        if "min_price" in params:
+            queryset = queryset.filter(price__gte=params["min_price"])
+        if "max_price" in params:
+            queryset = queryset.filter(price__lte=params["max_price"])
+        if params["in_stock"] is True:
+            queryset = queryset.filter(stock_quantity__gt=0)
+        elif params["in_stock"] is False:
+            queryset = queryset.filter(stock_quantity=0)
+        if "created_after" in params:
+            queryset = queryset.filter(created_at__gte=params["created_after"])
+        if "created_before" in params:
+            queryset = queryset.filter(created_at__lt=params["created_before"])
+
+        category_id = params.get("category")
+        if category_id is not None:
+            if params["descendants"]:
+                if subtree_path is None:
+                    return queryset.none()
+                # Resolves into a single indexed prefix scan over the category paths
+                queryset = queryset.filter(category__path__startswith=subtree_path)
+            else:
+                queryset = queryset.filter(category_id=category_id)
+        return queryset
+
+
+@extend_schema(tags=["products"], summary="Search products", parameters=[ProductSearchSerializer])
+class ProductSearchView(CachedResponseMixin, ConditionalGetMixin, ListAPIView):
+    serializer_class = ProductSerializer
+    pagination_class = CachedKeysetPagination
+    replica_reads = True
+    public_cache = True
+    validators_from_body = True
+    # The rank is cast to double precision, so cursors compare it exactly
+    keyset_ordering = ("-rank", "-id")
+
+    def get_queryset(self):
+        params = ProductSearchSerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        query = self.get_search_query(params.validated_data["q"])
+        if query is None:
+            return Product.objects.none().annotate(rank=Value(0.0, FloatField()))
+        return Product.objects.filter(search_vector=query).annotate(
+            rank=Cast(SearchRank(F("search_vector"), query), FloatField())
+        )
+
+    @staticmethod
+    def get_search_query(text):
+        """
+        All words must match, the last one as a prefix for autocomplete.
+        Only word characters are kept, so the text can't inject tsquery syntax.
+        """
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            return None
+        words[-1] = f"{words[-1]}:*"
+        return SearchQuery(" & ".join(words), search_type="raw", config="english")
 
 
 @extend_schema(tags=["products"], summary="Product details")
-class ProductDetailView(RetrieveAPIView):
+class ProductDetailView(
+    CachedResponseMixin, CachedObjectMixin, ConditionalGetMixin, RetrieveAPIView
+):
+    replica_reads = True
+    public_cache = True
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
 
 
 @extend_schema(tags=["products"], summary="Product reviews")
-class ProductReviewListView(ListAPIView):
+class ProductReviewListView(
+    CachedResponseMixin, ConditionalGetMixin, ValuesListMixin, ListAPIView
+):
     serializer_class = ReviewSerializer
-    pagination_class = CachedLimitOffsetPagination
+    pagination_class = CachedCatalogPagination
+    replica_reads = True
+    public_cache = True
 
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs["pk"])
 
 
-class ReviewViewSet(GenericViewSet):
+class ReviewViewSet(ConditionalGetMixin, GenericViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     lookup_field = "pk"
     permission_classes = (IsAuthenticated,)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method in ("PUT", "DELETE"):
+            # Rating deltas must be computed from the state the change is applied to
+            queryset = queryset.select_for_update()
+        return queryset
+
     @extend_schema(tags=["products"], summary="Add review to product")
     @action(methods=["POST"], detail=True)
+    @transaction.atomic
     def add_review(self, request):
         serializer = ReviewSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.validated_data["user"] = request.user
+        serializer.validated_data["user_id"] = request.user.id
+        # Rating aggregates of the product are updated by the review signals
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @extend_schema(tags=["products"], summary="Delete review")
     @action(methods=["DELETE"], detail=True)
+    @transaction.atomic
     def delete_review(self, request, pk):
         review = self.get_object()
-        if review.user != request.user:
+        if review.user_id != request.user.id:
             return Response(status=status.HTTP_403_FORBIDDEN)
         review.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @extend_schema(tags=["products"], summary="Update review")
     @action(methods=["PUT"], detail=True)
+    @transaction.atomic
     def update_review(self, request, pk):
         review = self.get_object()
-        if review.user != request.user:
+        if review.user_id != request.user.id:
             return Response(status=status.HTTP_403_FORBIDDEN)
         serializer = ReviewSerializer(review, data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -1,5 +1,7 @@
 from core.models.orders import Order, OrderItem
 from core.models.shopping import CartItem, ShoppingCart, Wishlist, WishlistItem
+from core.stock import InsufficientStock, get_order_quantities, reserve_stock
+from django.db import transaction
 from drf_spectacular.views import OpenApiParameter, extend_schema
 from rest_framework import serializers, status, viewsets
 from rest_framework.decorators import action
@@ -41,36 +43,57 @@ class ShoppingCartViewSet(viewsets.GenericViewSet):
     serializer_class = ShoppingCartSerializer
     permission_classes = (IsAuthenticated,)
     queryset = ShoppingCart.objects.all()
+    # Checkout is served before catalog browsing under overload, see core.admission
+    admission_priority = "high"
+    # GET creates the cart, the user must still exist
+    check_token_user = True
 
     @extend_schema(
-        summary="Make order", responses={status.HTTP_201_CREATED: None}, request=MakeOrderSerializer
+        summary="Make order",
+        responses={status.HTTP_201_CREATED: None, status.HTTP_409_CONFLICT: None},
+        request=MakeOrderSerializer,
     )
     @action(methods=["POST"], detail=False)
+    @transaction.atomic
     def make_order(self, request):
         serializer = self.MakeOrderSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        cart = self.queryset.get(user=request.user)
-        if not serializer.validated_data["items"]:
-            cart_items = cart.items.all()
-        else:
-            cart_items = cart.items.filter(id__in=serializer.validated_data["items"])
+        cart = self.queryset.get(user_id=request.user.id)
+        cart_items = cart.items.select_related("product")
+        if serializer.validated_data["items"]:
+            cart_items = cart_items.filter(id__in=serializer.validated_data["items"])
 
-        if not cart_items.exists():
+        cart_items = list(cart_items)
+        if not cart_items:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        order = Order.objects.create(user=request.user)
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order, product=cart_item.product, quantity=cart_item.quantity
+        try:
+            reserve_stock(get_order_quantities(cart_items))
+        except InsufficientStock as exc:
+            return Response(
+                data={"detail": "Insufficient stock", "product_ids": exc.product_ids},
+                status=status.HTTP_409_CONFLICT,
             )
-            cart_item.delete()
-        order.save()
+
+        # The number of queries doesn't depend on the number of items in the cart
+        order = Order.objects.create(user_id=request.user.id)
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product=cart_item.product,
+                quantity=cart_item.quantity,
+                price=cart_item.product.price * cart_item.quantity,
+            )
+            for cart_item in cart_items
+        )
+        CartItem.objects.filter(id__in=[cart_item.id for cart_item in cart_items]).delete()
+        order.update_total_price()
         return Response(data={"order_id": order.id}, status=status.HTTP_201_CREATED)
 
     @extend_schema(summary="Get shopping cart", responses=ShoppingCartSerializer)
     @action(methods=["GET"], detail=False)
     def get_shopping_cart(self, request):
-        cart, _ = self.queryset.get_or_create(user=request.user)
+        cart, _ = self.queryset.get_or_create(user_id=request.user.id)
         serializer = self.ShoppingCartSerializer(cart)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
 
@@ -83,7 +106,7 @@ class ShoppingCartViewSet(viewsets.GenericViewSet):
     def add_product(self, request):
         serializer = self.RequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        cart, _ = self.queryset.get_or_create(user=request.user)
+        cart, _ = self.queryset.get_or_create(user_id=request.user.id)
         cart_item, created_item = CartItem.objects.get_or_create(
             product_id=serializer.validated_data["product_id"], cart=cart
         )
@@ -106,7 +129,7 @@ class ShoppingCartViewSet(viewsets.GenericViewSet):
     def delete_product(self, request):
         serializer = self.RequestSerializer(data=request.query_params)
         serializer.is_valid(raise_exception=True)
-        cart, _ = self.queryset.get_or_create(user=request.user)
+        cart, _ = self.queryset.get_or_create(user_id=request.user.id)
         try:
             cart_item = CartItem.objects.get(
                 product_id=serializer.validated_data["product_id"], cart=cart
@@ -123,7 +146,7 @@ class ShoppingCartViewSet(viewsets.GenericViewSet):
     @extend_schema(summary="Clear shopping cart", responses={status.HTTP_204_NO_CONTENT: None})
     @action(methods=["DELETE"], detail=False)
     def clear_shopping_cart(self, request):
-        cart = self.queryset.get(user=request.user)
+        cart = self.queryset.get(user_id=request.user.id)
         cart.items.all().delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -153,18 +176,20 @@ class WishlistViewSet(viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = WishlistSerializer
     queryset = Wishlist.objects.all()
+    # GET creates the wishlist, the user must still exist
+    check_token_user = True
 
     @extend_schema(summary="Get wishlist", responses=WishlistSerializer)
     @action(methods=["GET"], detail=False)
     def get_wishlist(self, request):
-        wishlist, _ = self.queryset.get_or_create(user=request.user)
+        wishlist, _ = self.queryset.get_or_create(user_id=request.user.id)
         serializer = self.serializer_class(wishlist)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
 
     @extend_schema(summary="Clear wishlist", responses={status.HTTP_204_NO_CONTENT: None})
     @action(methods=["DELETE"], detail=False)
     def clear_wishlist(self, request):
-        wishlist = self.queryset.get(user=request.user)
+        wishlist = self.queryset.get(user_id=request.user.id)
         wishlist.items.all().delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -177,7 +202,7 @@ class WishlistViewSet(viewsets.GenericViewSet):
     def add_product(self, request):
         serializer = self.RequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        wishlist, _ = self.queryset.get_or_create(user=request.user)
+        wishlist, _ = self.queryset.get_or_create(user_id=request.user.id)
         _, created_item = WishlistItem.objects.get_or_create(
             product_id=serializer.validated_data["product_id"], wishlist=wishlist
         )
@@ -194,7 +219,7 @@ class WishlistViewSet(viewsets.GenericViewSet):
     def delete_product(self, request):
         serializer = self.RequestSerializer(data=request.query_params)
         serializer.is_valid(raise_exception=True)
-        wishlist, _ = self.queryset.get_or_create(user=request.user)
+        wishlist, _ = self.queryset.get_or_create(user_id=request.user.id)
         try:
             wishlist_item = WishlistItem.objects.get(
                 product_id=serializer.validated_data["product_id"], wishlist=wishlist
@@ -0,0 +1,126 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from urllib.parse import urlencode, urlsplit
+
+import redis
+from django.conf import settings
+from django.core.exceptions import DisallowedHost, ImproperlyConfigured
+from django.db import connections
+from django.db.models import Sum
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve, reverse
+from rest_framework import status
+
+from .hits import get_hot_urls
+from .models.orders import OrderItem
+
+logger = getLogger(__name__)
+
+
+def validate_base_url(base_url):
+    """
+    Cached responses contain links built from the scheme and host of the warming request and
+    are cached per host, so the seeds must use the public URL of the API.
+    Raises ImproperlyConfigured when it is unset or its host isn't allowed.
+    """
+    if not base_url:
+        raise ImproperlyConfigured("Set CACHE_WARMUP_BASE_URL to the public URL of the API")
+    parts = urlsplit(base_url)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        raise ImproperlyConfigured(f"Cache warm-up base URL {base_url!r} isn't an http(s) URL")
+    try:
+        RequestFactory().get("/", HTTP_HOST=parts.netloc).get_host()
+    except DisallowedHost:
+        raise ImproperlyConfigured(f"Host of {base_url!r} isn't in ALLOWED_HOSTS")
+
+
+def get_seed_urls(base_url, pages, products):
+    """
+    URLs worth warming even without recorded hits, e.g. after a Redis flush: the category tree,
+    the first pages of the category and product lists and the top-selling products.
+    """
+    base_url = base_url.rstrip("/")
+    urls = [reverse("category-tree")]
+    limit = settings.REST_FRAMEWORK["PAGE_SIZE"]
+    for name in ("category-list", "product-list"):
+        path = reverse(name)
+        urls.append(path)
+        # The same query strings as the `next` links
+        urls += [
+            f"{path}?{urlencode({'limit': limit, 'offset': page * limit})}"
+            for page in range(1, pages)
+        ]
+    top_selling = (
+        OrderItem.objects.values("product")
+        .annotate(sold=Sum("quantity"))
+        .order_by("-sold")
+        .values_list("product", flat=True)[:products]
+    )
+    urls += [reverse("product-detail", args=[product_id]) for product_id in top_selling]
+    return [f"{base_url}{url}" for url in urls]
+
+
+def warm_url(url):
+    """
+    Render a cached GET view in process, which fills its cache entries.
+    Returns the status code, None when the URL isn't a view.
+    """
+    parts = urlsplit(url)
+    try:
+        match = resolve(parts.path)
+    except Resolver404:
+        return None
+    request = RequestFactory().get(
+        f"{parts.path}?{parts.query}" if parts.query else parts.path,
+        HTTP_HOST=parts.netloc,
+        secure=parts.scheme == "https",
+    )
+    request.cache_warmup = True
+    try:
+        return match.func(request, *match.args, **match.kwargs).status_code
+    finally:
+        # Every thread of the pool has its own connections
+        connections.close_all()
+
+
+def warm_urls(urls, concurrency, budget):
+    """
+    Warm URLs in the given order with `concurrency` threads. URLs not started within
+    `budget` seconds are skipped. Returns the number of warmed and skipped URLs.
+    """
+    deadline = time.monotonic() + budget
+
+    def warm(url):
+        if time.monotonic() >= deadline:
+            return False
+        try:
+            status_code = warm_url(url)
+            # Seeds can point past the last page
+            if status_code is None or status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+                logger.warning("Cache warm-up of %s returned %s", url, status_code)
+        except Exception:
+            logger.exception("Cache warm-up of %s failed", url)
+        return True
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        warmed = sum(executor.map(warm, urls))
+    return warmed, len(urls) - warmed
+
+
+def warm_cache(limit, pages, products, concurrency, budget, base_url=None):
+    """
+    Warm the hottest recorded URLs, then the seed URLs that were not among them.
+    Returns (warmed, skipped).
+    """
+    base_url = base_url or settings.CACHE_WARMUP_BASE_URL
+    validate_base_url(base_url)
+    try:
+        urls = get_hot_urls(limit)
+    except redis.RedisError:
+        logger.exception("Failed to read cache hit counters")
+        urls = []
+    hot = set(urls)
+    seeds = get_seed_urls(base_url, pages, products)
+    urls += [url for url in seeds if url not in hot]
+    return warm_urls(urls, concurrency, budget)
@@ -4,39 +4,15 @@ set -o errexit
 set -o pipefail
 set -o nounset
 
-postgres_is_not_ready() {
-python << END
-import os
-import psycopg2
-import sys
-
-try:
-    psycopg2.connect(
-        host=os.environ["POSTGRES_HOST"],
-        port=os.environ["POSTGRES_PORT"],
-        dbname=os.environ["POSTGRES_DB"],
-        user=os.environ["POSTGRES_USER"],
-        password=os.environ["POSTGRES_PASSWORD"]
-    )
-except psycopg2.OperationalError as e:
-    print(e)
-    sys.exit(-1)
-
-sys.exit(0)
-END
-}
-
-until postgres_is_not_ready; do
-  >&2 echo 'Waiting for PostgreSQL to become available...'
-  sleep 1
-done
->&2 echo 'PostgreSQL is available'
-
-NUM_WORKERS=${NUM_WORKERS:-1}
-TIMEOUT=${TIMEOUT:-180}
-
-python manage.py collectstatic --no-input
-python manage.py migrate
-python manage.py runserver 0.0.0.0:8000
-
-exec "$@"
+# Migrations and static files are handled once per deploy by django-release.sh
+source "$(dirname "$0")/wait-for-postgres.sh"
+
+# Metrics of all gunicorn workers are aggregated from this directory
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# NUM_WORKERS, TIMEOUT and the other knobs are read by config/gunicorn.py.
+# The async catalog is served with GUNICORN_APP=config.asgi:application
+# and GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker.
+exec gunicorn --config config/gunicorn.py "${GUNICORN_APP:-config.wsgi:application}"
@@ -0,0 +1,15 @@
+#!/bin/bash
+
+set -o errexit
+set -o pipefail
+set -o nounset
+
+# One-shot release step, run before the servers start
+source "$(dirname "$0")/wait-for-postgres.sh"
+
+python manage.py migrate --no-input
+python manage.py collectstatic --no-input
+# The new code has new cache keys, fill the hottest ones before the servers take traffic.
+# Cached responses are per host, so warming another host than the public one is wasted.
+: "${CACHE_WARMUP_BASE_URL:?Set CACHE_WARMUP_BASE_URL to the public URL of the API}"
+python manage.py warm_cache --budget "${CACHE_WARMUP_BUDGET:-60}" || echo "Cache warm-up failed"